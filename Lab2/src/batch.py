@@ -0,0 +1,98 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator
+
+import matplotlib
+
+# batch runs are headless, so no effect may open a window
+matplotlib.use("Agg")
+
+from main import Canvas, EFFECTS
+from lut import compile_effect
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+# Lazily yields input files so that huge directories are never listed into memory
+def iter_files(source: str) -> Iterator[str]:
+    if os.path.isdir(source):
+        with os.scandir(source) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield entry.path
+    else:
+        yield from glob.iglob(source, recursive=True)
+
+
+def parse_param(param: str) -> (str, float):
+    key, value = param.split("=", 1)
+    # "from" is a keyword, effects take it as "_from"
+    key = "_from" if key == "from" else key
+    try:
+        return key, int(value)
+    except ValueError:
+        return key, float(value)
+
+
+def apply_effect(file_name: str, out_dir: str, effect: str, params: dict) -> str:
+    out_file_name = os.path.join(out_dir, os.path.basename(file_name))
+    frame_cb = compile_effect(EFFECTS[effect](**params))
+    Canvas.edit_frame_by_cb(file_name, frame_cb, show=False, out_file_name=out_file_name)
+    return out_file_name
+
+
+# Returns the numbers of processed and skipped files
+def run_batch(source: str, out_dir: str, effect: str, params: dict, workers: int = None) -> (int, int):
+    # the effect is built once here so that bad parameters fail before any file is queued,
+    # the workers build their own as frame callbacks cannot be pickled
+    EFFECTS[effect](**params)
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    # at most a couple of files per worker are queued, the rest stay in the iterator
+    max_pending = workers * 2
+    done_count = skipped_count = 0
+    start = time.perf_counter()
+
+    # a file that fails is reported and skipped, the rest of the batch goes on
+    def collect(done):
+        nonlocal done_count, skipped_count
+        for future in done:
+            try:
+                done_count += bool(future.result())
+            except Exception as error:
+                skipped_count += 1
+                print(f"Skipped {pending[future]}: {error}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for file_name in iter_files(source):
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+                for future in done:
+                    del pending[future]
+            pending[executor.submit(apply_effect, file_name, out_dir, effect, params)] = file_name
+        collect(pending)
+
+    elapsed = time.perf_counter() - start
+    rate = done_count / elapsed if elapsed else 0
+    print(f"Processed {done_count} images in {elapsed:.2f}s ({rate:.2f} images/s), skipped {skipped_count}")
+    return done_count, skipped_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a tone effect to many images without display")
+    parser.add_argument("source", help="input directory or glob pattern")
+    parser.add_argument("effect", choices=EFFECTS.keys())
+    parser.add_argument("-o", "--out", default="out", help="output directory")
+    parser.add_argument("-p", "--param", action="append", default=[], type=parse_param,
+                        help="effect parameter as name=value, e.g. -p depth=20 -p from=0.4")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="process pool size")
+    args = parser.parse_args()
+
+    _, skipped = run_batch(args.source, args.out, args.effect, dict(args.param), args.workers)
+    sys.exit(1 if skipped else 0)
@@ -0,0 +1,128 @@
+import argparse
+import copy
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
+from PIL import Image
+
+from main import EFFECTS, FrameCallback, FrameParams, FrameRGB, get_center, normalize_frame
+
+LEVELS = np.arange(256, dtype=np.int32).reshape(-1, 1, 1)
+
+
+def compilable_axes(frame_cb: FrameCallback) -> tuple or None:
+    axes = getattr(frame_cb, "channelwise_axes", None)
+    # a table per pixel would be 256 times bigger than the image itself
+    if axes is None or {"x", "y"} <= set(axes):
+        return None
+    return axes
+
+
+# Evaluates the effect once for every channel level on a single row and/or column of the frame,
+# giving one 256-entry table per column, per row or for the whole frame
+def build_luts(frame_cb: FrameCallback, params: FrameParams, axes: tuple) -> list[np.ndarray]:
+    probe = copy.copy(params)
+    probe.r = probe.g = probe.b = LEVELS
+    if "x" not in axes:
+        probe.x = params.x[:, :1]
+        probe.columns = slice(params.columns.start, params.columns.start + 1)
+    if "y" not in axes:
+        probe.y = params.y[:1, :]
+        probe.rows = slice(params.rows.start, params.rows.start + 1)
+    res = frame_cb(probe)
+    channels = res if isinstance(res, tuple) else [res[..., i] for i in range(3)]
+
+    shape = (256, probe.y.shape[0], probe.x.shape[1])
+    luts = []
+    for channel in channels:
+        table = np.clip(np.broadcast_to(channel, shape), 0, 255).astype(np.uint8)
+        # flattened so that a lookup is a single take() at position * 256 + level
+        luts.append(table.reshape(256, -1).T.ravel())
+    return luts
+
+
+def lut_offsets(params: FrameParams, axes: tuple) -> np.ndarray or int:
+    tile_h, tile_w = params.r.shape
+    if "x" in axes:
+        return (np.arange(tile_w, dtype=np.int32) * 256)[np.newaxis, :]
+    if "y" in axes:
+        return (np.arange(tile_h, dtype=np.int32) * 256)[:, np.newaxis]
+    return 0
+
+
+def apply_luts(luts: list[np.ndarray], offsets: np.ndarray or int, params: FrameParams) -> FrameRGB:
+    return tuple(lut.take(channel + offsets) for lut, channel in zip(luts, (params.r, params.g, params.b)))
+
+
+# Replaces a channelwise effect by table lookups, other effects are returned unchanged
+def compile_effect(frame_cb: FrameCallback) -> FrameCallback:
+    axes = compilable_axes(frame_cb)
+    if axes is None:
+        return frame_cb
+
+    cache = {}
+
+    def lut_cb(params: FrameParams) -> FrameRGB:
+        key = (params.w, params.h, params.columns.start, params.columns.stop, params.rows.start, params.rows.stop)
+        if key not in cache:
+            cache.clear()
+            cache[key] = build_luts(frame_cb, params, axes), lut_offsets(params, axes)
+        return apply_luts(*cache[key], params)
+
+    lut_cb.channelwise_axes = axes
+    return lut_cb
+
+
+# Stand-in for Canvas that only carries the image size
+class BenchCanvas:
+    width: int
+    height: int
+
+    def __init__(self, rgb: np.ndarray):
+        self.height, self.width, *_ = rgb.shape
+
+    def get_center_width(self):
+        return get_center(self.width)
+
+    def get_center_height(self):
+        return get_center(self.height)
+
+
+def measure(frame_cb: FrameCallback, canvas: BenchCanvas, rgb: np.ndarray, repeat: int) -> (float, np.ndarray):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = normalize_frame(frame_cb(FrameParams(canvas, rgb)), rgb.shape[:2])
+    return (time.perf_counter() - start) / repeat, res
+
+
+def benchmark(file_name: str, repeat: int = 5) -> None:
+    rgb = np.asarray(Image.open(file_name).convert("RGB"))
+    canvas = BenchCanvas(rgb)
+    print(f"|-Image: {file_name} {canvas.width}x{canvas.height}, {repeat} runs")
+    cases = [(name, effect()) for name, effect in EFFECTS.items()]
+    cases.append(("negative from=to=1", EFFECTS["negative"](1, 1)))
+    for name, frame_cb in cases:
+        compiled = compile_effect(frame_cb)
+        if compiled is frame_cb:
+            print(f"|---{name}: no lookup table form, stays on the array path")
+            continue
+
+        array_time, expected = measure(frame_cb, canvas, rgb, repeat)
+        lut_time, res = measure(compiled, canvas, rgb, repeat)
+        same = np.array_equal(expected, res)
+        print(f"|---{name}: array {array_time * 1000:.1f}ms, lut {lut_time * 1000:.1f}ms, "
+              f"x{array_time / lut_time:.1f}, same output: {same}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare compiled lookup table effects with the array path")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        benchmark(file_name, args.repeat)
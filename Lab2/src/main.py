@@ -1,5 +1,8 @@
+import copy
+from collections import OrderedDict
 from typing import Callable
 
+import numpy as np
 from PIL import Image, ImageDraw, PyAccess
 from matplotlib import pyplot
 
@@ -11,6 +14,88 @@ def map_from_to(x: float, in_min: float, in_max: float, out_min: float, out_max:
 Center = (int, int) or int
 RGB = tuple[int, int, int]
 PixelCallback = Callable[['CbParams'], RGB]
+FrameRGB = tuple[np.ndarray, np.ndarray, np.ndarray] or np.ndarray
+FrameCallback = Callable[['FrameParams'], FrameRGB]
+
+
+def get_center(num: int) -> Center:
+    if num % 2 == 0:
+        center = (num // 2 - 1, num // 2)
+    else:
+        center = num // 2
+
+    return center
+
+
+def center_ration(nums: np.ndarray, size: int, center: Center) -> np.ndarray:
+    less, greater = center if isinstance(center, tuple) else (center, center)
+    ratio = np.ones(nums.shape)
+    np.divide(nums, less, out=ratio, where=nums < less)
+    np.divide(size - nums - 1, greater, out=ratio, where=nums > greater)
+    return ratio
+
+
+# Marks a frame callback that maps every channel on its own and depends only on the given axes ("x", "y")
+def channelwise(*axes: str) -> Callable[[FrameCallback], FrameCallback]:
+    def decorate(frame_cb: FrameCallback) -> FrameCallback:
+        frame_cb.channelwise_axes = axes
+        return frame_cb
+
+    return decorate
+
+
+# Clamp the result of a frame callback into a (height, width, 3) uint8 image
+def normalize_frame(res: FrameRGB, size: (int, int)) -> np.ndarray:
+    if isinstance(res, tuple):
+        res = np.stack(np.broadcast_arrays(*res), axis=-1)
+    return np.broadcast_to(np.clip(res, 0, 255), (*size, 3)).astype(np.uint8)
+
+
+# Mapped center and start ratios of every column and row for one image size and mapping range
+class RatioGrids:
+    x_center: np.ndarray
+    y_center: np.ndarray
+    x_start: np.ndarray
+    y_start: np.ndarray
+
+    def __init__(self, w: int, h: int, _from: float, to: float):
+        x = np.arange(w)[np.newaxis, :]
+        y = np.arange(h)[:, np.newaxis]
+        self.x_center = map_from_to(center_ration(x, w, get_center(w)), 0, 1, _from, to)
+        self.y_center = map_from_to(center_ration(y, h, get_center(h)), 0, 1, _from, to)
+        self.x_start = map_from_to(x / w, 0, 1, _from, to)
+        # like CbParams.y_start_ration, the row start ratio is relative to the width
+        self.y_start = map_from_to(y / w, 0, 1, _from, to)
+        for grid in (self.x_center, self.y_center, self.x_start, self.y_start):
+            grid.flags.writeable = False
+
+
+# Least recently used cache of RatioGrids keyed by (width, height, from, to)
+class GridCache:
+    max_size: int
+    grids: OrderedDict
+
+    def __init__(self, max_size: int = 8):
+        self.max_size = max_size
+        self.grids = OrderedDict()
+
+    def get(self, w: int, h: int, _from: float, to: float) -> RatioGrids:
+        key = (w, h, _from, to)
+        if key in self.grids:
+            self.grids.move_to_end(key)
+            return self.grids[key]
+
+        grids = RatioGrids(w, h, _from, to)
+        self.grids[key] = grids
+        if len(self.grids) > self.max_size:
+            self.grids.popitem(last=False)
+        return grids
+
+    def clear(self) -> None:
+        self.grids.clear()
+
+
+GRID_CACHE = GridCache()
 
 
 class CbParams:
@@ -80,8 +165,8 @@ class CbParams:
         return self.x_center_ration(), self.y_center_ration()
 
     def center_ratio_map_to(self, _from: float, to: float) -> (float, float):
-        return map_from_to(self.x_center_ration(), 0, 1, _from, to), \
-            map_from_to(self.y_center_ration(), 0, 1, _from, to)
+        grids = GRID_CACHE.get(self.w, self.h, _from, to)
+        return float(grids.x_center[0, self.x]), float(grids.y_center[self.y, 0])
 
     def x_start_ration(self) -> float:
         return self.x / self.w
@@ -93,8 +178,8 @@ class CbParams:
         return self.x_start_ration(), self.y_start_ration()
 
     def start_ration_map_to(self, _from: float, to: float) -> (float, float):
-        return map_from_to(self.x_start_ration(), 0, 1, _from, to), \
-            map_from_to(self.y_start_ration(), 0, 1, _from, to)
+        grids = GRID_CACHE.get(self.w, self.h, _from, to)
+        return float(grids.x_start[0, self.x]), float(grids.y_start[self.y, 0])
 
     def __init__(self, canvas, r: int, g: int, b: int, x: int, y: int):
         self.r = r
@@ -111,8 +196,69 @@ class CbParams:
         return f"w:{self.w}; h:{self.h}; center_w: {self.center_w}; center_h: {self.center_h}; x: {self.x}; y: {self.y}; x_ratio: {self.x_center_ration()}; y_ration: {self.y_center_ration()};"
 
 
+# Whole-image counterpart of CbParams: every attribute is an array and every ratio is a grid
+class FrameParams:
+    r: np.ndarray
+    g: np.ndarray
+    b: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    w: int
+    h: int
+    center_w: Center
+    center_h: Center
+    # Position of the frame inside the whole image, when only a tile of it is processed
+    columns: slice
+    rows: slice
+
+    def x_center_ration(self) -> np.ndarray:
+        return center_ration(self.x, self.w, self.center_w)
+
+    def y_center_ration(self) -> np.ndarray:
+        return center_ration(self.y, self.h, self.center_h)
+
+    def center_ratio(self) -> (np.ndarray, np.ndarray):
+        return self.x_center_ration(), self.y_center_ration()
+
+    def center_ratio_map_to(self, _from: float, to: float) -> (np.ndarray, np.ndarray):
+        grids = GRID_CACHE.get(self.w, self.h, _from, to)
+        return grids.x_center[:, self.columns], grids.y_center[self.rows, :]
+
+    def x_start_ration(self) -> np.ndarray:
+        return self.x / self.w
+
+    def y_start_ration(self) -> np.ndarray:
+        return self.y / self.w
+
+    def start_ration(self) -> (np.ndarray, np.ndarray):
+        return self.x_start_ration(), self.y_start_ration()
+
+    def start_ration_map_to(self, _from: float, to: float) -> (np.ndarray, np.ndarray):
+        grids = GRID_CACHE.get(self.w, self.h, _from, to)
+        return grids.x_start[:, self.columns], grids.y_start[self.rows, :]
+
+    def __init__(self, canvas, rgb: np.ndarray, x0: int = 0, y0: int = 0):
+        self.r = rgb[..., 0].astype(np.int32)
+        self.g = rgb[..., 1].astype(np.int32)
+        self.b = rgb[..., 2].astype(np.int32)
+        self.w = canvas.width
+        self.h = canvas.height
+        tile_h, tile_w, *_ = rgb.shape
+        self.columns = slice(x0, x0 + tile_w)
+        self.rows = slice(y0, y0 + tile_h)
+        # x and y are broadcastable grids: one row of columns and one column of rows
+        self.x = np.arange(x0, x0 + tile_w)[np.newaxis, :]
+        self.y = np.arange(y0, y0 + tile_h)[:, np.newaxis]
+        self.center_w = canvas.get_center_width()
+        self.center_h = canvas.get_center_height()
+
+    def __str__(self) -> str:
+        return f"w:{self.w}; h:{self.h}; center_w: {self.center_w}; center_h: {self.center_h};"
+
+
 class Canvas:
     file_name: str
+    out_file_name: str or None
     show: bool
     image: Image
     draw: ImageDraw
@@ -121,20 +267,26 @@ class Canvas:
     height: int
 
     def get_center_width(self):
-        return self.__get_center(self.width)
+        return get_center(self.width)
 
     def get_center_height(self):
-        return self.__get_center(self.height)
+        return get_center(self.height)
 
-    def __init__(self, file_name: str, show: bool):
+    def __init__(self, file_name: str, show: bool, out_file_name: str = None):
         self.file_name = file_name
+        self.out_file_name = out_file_name
         self.show = show
 
     @staticmethod
-    def edit_pixels_by_cb(file_name: str, pixel_cb: PixelCallback, show=True) -> None:
-        canvas = Canvas(file_name, show)
+    def edit_pixels_by_cb(file_name: str, pixel_cb: PixelCallback, show=True, out_file_name=None) -> None:
+        canvas = Canvas(file_name, show, out_file_name)
         canvas.draw_pixels_and_close(pixel_cb)
 
+    @staticmethod
+    def edit_frame_by_cb(file_name: str, frame_cb: FrameCallback, show=True, out_file_name=None) -> None:
+        canvas = Canvas(file_name, show, out_file_name)
+        canvas.draw_frame_and_close(frame_cb)
+
     def __enter__(self) -> 'Canvas':
         self.image = Image.open(self.file_name)
         self.draw = ImageDraw.Draw(self.image)
@@ -153,13 +305,10 @@ class Canvas:
         pyplot.imshow(self.image)
         pyplot.show()
 
-    def __get_center(self, num) -> Center:
-        if num % 2 == 0:
-            center = (num // 2 - 1, num // 2)
-        else:
-            center = num // 2
-
-        return center
+    def __finish(self) -> None:
+        if self.out_file_name:
+            self.image.save(self.out_file_name)
+        if self.show: self.__show_image();
 
     def draw_pixels_and_close(self, pixel_callback: PixelCallback) -> None:
         with self as canvas:
@@ -169,7 +318,15 @@ class Canvas:
                     params = CbParams(canvas, r, g, b, x, y)
                     res = pixel_callback(params)
                     canvas.draw.point((x, y), self.__normalize(res))
-            canvas.__show_image()
+            canvas.__finish()
+
+    def draw_frame_and_close(self, frame_callback: FrameCallback) -> None:
+        with self as canvas:
+            rgb = np.asarray(canvas.image.convert("RGB"))
+            params = FrameParams(canvas, rgb)
+            res = frame_callback(params)
+            canvas.image.paste(Image.fromarray(normalize_frame(res, (canvas.height, canvas.width))))
+            canvas.__finish()
 
     def __normalize(self, res: RGB) -> RGB:
         def bound(val):
@@ -182,54 +339,114 @@ class Canvas:
         return tuple(map(bound, res))
 
 
-def gray_shade(file_name: str, _from: float = 0.1, to: float = 1.8):
-    def pixel_cb(params: CbParams) -> RGB:
+def gray_shade_cb(_from: float = 0.1, to: float = 1.8) -> FrameCallback:
+    def frame_cb(params: FrameParams) -> FrameRGB:
         x_ratio, y_ratio = params.center_ratio_map_to(_from, to)
-        try:
-            mean = int((params.r + params.g + params.b) // 3 * x_ratio * y_ratio)
-        except ZeroDivisionError:
-            mean = 255
+        mean = np.trunc((params.r + params.g + params.b) // 3 * x_ratio * y_ratio)
         return mean, mean, mean
 
-    Canvas.edit_pixels_by_cb(file_name, pixel_cb)
+    return frame_cb
 
 
-def serpia_shade(file_name: str, depth: int = 20, _from: float = 0.4, to: float = 1.6):
-    def pixel_cb(params: CbParams) -> RGB:
+def serpia_shade_cb(depth: int = 20, _from: float = 0.4, to: float = 1.6) -> FrameCallback:
+    def frame_cb(params: FrameParams) -> FrameRGB:
         x_ratio, y_ratio = params.center_ratio_map_to(_from, to)
-        try:
-            mean = int((params.r + params.g + params.b) // (3 * x_ratio * y_ratio))
-        except ZeroDivisionError:
-            mean = 255
+        divider = 3 * x_ratio * y_ratio
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.trunc((params.r + params.g + params.b) // divider)
+        mean = np.where(divider == 0, 255, mean)
 
         r = mean + depth * 4
         g = mean + depth
         b = mean
         return r, g, b
 
-    Canvas.edit_pixels_by_cb(file_name, pixel_cb)
+    return frame_cb
 
 
-def negative(file_name: str, _from: float = 0.3, to: float = 3):
-    def pixel_cb(params: CbParams) -> RGB:
+def negative_cb(_from: float = 0.3, to: float = 3) -> FrameCallback:
+    # with an empty range both ratios are the constant _from
+    axes = () if _from == to else ("x", "y")
+
+    @channelwise(*axes)
+    def frame_cb(params: FrameParams) -> FrameRGB:
         x_ratio, y_ratio = params.start_ration_map_to(_from, to)
-        color = lambda i: int(255 - i * x_ratio * y_ratio)
+        color = lambda i: np.trunc(255 - i * x_ratio * y_ratio)
         return color(params.r), color(params.g), color(params.b)
 
-    Canvas.edit_pixels_by_cb(file_name, pixel_cb)
+    return frame_cb
 
 
-def brightness(file_name: str, factor: int = 70, _from: float = -3, to: float = 3):
-    def pixel_cb(params: CbParams) -> RGB:
-        x_ratio = params.x_start_ration()
-        x_ratio = map_from_to(x_ratio, 0, 1, _from, to)
-        color = lambda i: int(i + factor * x_ratio)
+def brightness_cb(factor: int = 70, _from: float = -3, to: float = 3) -> FrameCallback:
+    @channelwise("x")
+    def frame_cb(params: FrameParams) -> FrameRGB:
+        x_ratio, _ = params.start_ration_map_to(_from, to)
+        color = lambda i: np.trunc(i + factor * x_ratio)
         return color(params.r), color(params.g), color(params.b)
 
-    Canvas.edit_pixels_by_cb(file_name, pixel_cb)
+    return frame_cb
+
+
+# Fuses several frame callbacks into one pass: intermediate results stay unclamped in float32 buffers
+# and only the final result is normalized by the canvas
+def chain(*frame_cbs: FrameCallback) -> FrameCallback:
+    if not frame_cbs:
+        raise ValueError("chain needs at least one effect")
+
+    def frame_cb(params: FrameParams) -> FrameRGB:
+        # two buffers are swapped so that an effect never overwrites the channels it reads
+        buffers = [None, None]
+        res = None
+        for i, effect_cb in enumerate(frame_cbs):
+            res = effect_cb(params)
+            if i == len(frame_cbs) - 1:
+                break
+
+            channels = res if isinstance(res, tuple) else tuple(res[..., c] for c in range(3))
+            shape = np.broadcast_shapes(params.r.shape, *(np.shape(channel) for channel in channels))
+            buffer = buffers[i % 2]
+            if buffer is None or buffer.shape[1:] != shape:
+                buffer = buffers[i % 2] = np.empty((3, *shape), dtype=np.float32)
+            for target, channel in zip(buffer, channels):
+                np.copyto(target, channel, casting="unsafe")
+
+            params = copy.copy(params)
+            params.r, params.g, params.b = buffer
+        return res
+
+    axes = [getattr(effect_cb, "channelwise_axes", None) for effect_cb in frame_cbs]
+    if None not in axes:
+        frame_cb = channelwise(*sorted(set().union(*axes)))(frame_cb)
+    return frame_cb
+
+
+# Frame callback factories by effect name
+EFFECTS: dict[str, Callable[..., FrameCallback]] = {
+    "gray_shade": gray_shade_cb,
+    "serpia_shade": serpia_shade_cb,
+    "negative": negative_cb,
+    "brightness": brightness_cb,
+}
+
+
+def gray_shade(file_name: str, _from: float = 0.1, to: float = 1.8):
+    Canvas.edit_frame_by_cb(file_name, gray_shade_cb(_from, to))
+
+
+def serpia_shade(file_name: str, depth: int = 20, _from: float = 0.4, to: float = 1.6):
+    Canvas.edit_frame_by_cb(file_name, serpia_shade_cb(depth, _from, to))
+
+
+def negative(file_name: str, _from: float = 0.3, to: float = 3):
+    Canvas.edit_frame_by_cb(file_name, negative_cb(_from, to))
+
+
+def brightness(file_name: str, factor: int = 70, _from: float = -3, to: float = 3):
+    Canvas.edit_frame_by_cb(file_name, brightness_cb(factor, _from, to))
 
 
-gray_shade("example1.jpg")
-serpia_shade("example2.jpg")
-negative("example3.jpg")
-brightness("example4.jpg")
+if __name__ == "__main__":
+    gray_shade("example1.jpg")
+    serpia_shade("example2.jpg")
+    negative("example3.jpg")
+    brightness("example4.jpg")
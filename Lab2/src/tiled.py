@@ -0,0 +1,119 @@
+import argparse
+import mmap
+import time
+
+import numpy as np
+
+from main import EFFECTS, FrameCallback, FrameParams, get_center, normalize_frame
+from batch import parse_param
+from lut import compile_effect
+
+DEFAULT_TILE = 1024
+
+
+def open_source(file_name: str, shape: (int, int) = None) -> np.memmap:
+    if file_name.endswith(".npy"):
+        return np.load(file_name, mmap_mode="r")
+    h, w = shape
+    return np.memmap(file_name, dtype=np.uint8, mode="r", shape=(h, w, 3))
+
+
+def open_target(file_name: str, shape: (int, int, int)) -> np.memmap:
+    if file_name.endswith(".npy"):
+        return np.lib.format.open_memmap(file_name, mode="w+", dtype=np.uint8, shape=shape)
+    return np.memmap(file_name, dtype=np.uint8, mode="w+", shape=shape)
+
+
+# Drop the mapped pages of the given rows so the resident size does not grow with the image.
+# It relies on the private _mmap of numpy memmaps, without it (or MADV_DONTNEED) the pages are left to the OS
+def release_rows(buffer: np.memmap, y0: int, y1: int) -> None:
+    mapping = getattr(buffer, "_mmap", None)
+    if mapping is None or not hasattr(mmap, "MADV_DONTNEED"):
+        return
+    row_bytes = buffer.strides[0]
+    # numpy maps from an allocation-aligned offset, the array starts this far into the mapping
+    start = buffer.offset % mmap.ALLOCATIONGRANULARITY + y0 * row_bytes
+    end = buffer.offset % mmap.ALLOCATIONGRANULARITY + y1 * row_bytes
+    start -= start % mmap.PAGESIZE
+    end -= end % mmap.PAGESIZE
+    if end > start:
+        mapping.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+# Canvas counterpart that streams fixed-size tiles between memory-mapped buffers.
+# Pages are released a band of tiles at a time, so the resident size is bounded by one full-width
+# band of tile_size rows of the source and the target, not by a single tile
+class TiledCanvas:
+    file_name: str
+    out_file_name: str
+    tile_size: int
+    shape: (int, int) or None
+    source: np.memmap
+    target: np.memmap
+    width: int
+    height: int
+
+    def get_center_width(self):
+        return get_center(self.width)
+
+    def get_center_height(self):
+        return get_center(self.height)
+
+    def __init__(self, file_name: str, out_file_name: str, tile_size: int = DEFAULT_TILE, shape: (int, int) = None):
+        self.file_name = file_name
+        self.out_file_name = out_file_name
+        self.tile_size = tile_size
+        self.shape = shape
+
+    @staticmethod
+    def edit_tiles_by_cb(file_name: str, out_file_name: str, frame_cb: FrameCallback,
+                         tile_size: int = DEFAULT_TILE, shape: (int, int) = None) -> None:
+        canvas = TiledCanvas(file_name, out_file_name, tile_size, shape)
+        canvas.draw_tiles_and_close(frame_cb)
+
+    def __enter__(self) -> 'TiledCanvas':
+        self.source = open_source(self.file_name, self.shape)
+        height, width, *_ = self.source.shape
+        self.width = width
+        self.height = height
+        self.target = open_target(self.out_file_name, (height, width, 3))
+        print(f"|-Image: {self.file_name} \n|---width: {width} \n|---height: {height} \n|---tile: {self.tile_size}")
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback) -> None:
+        self.target.flush()
+        del self.source
+        del self.target
+
+    def draw_tiles_and_close(self, frame_callback: FrameCallback) -> None:
+        with self as canvas:
+            size = canvas.tile_size
+            for y0 in range(0, canvas.height, size):
+                y1 = min(y0 + size, canvas.height)
+                for x0 in range(0, canvas.width, size):
+                    x1 = min(x0 + size, canvas.width)
+                    tile = np.asarray(canvas.source[y0:y1, x0:x1, :3])
+                    params = FrameParams(canvas, tile, x0, y0)
+                    canvas.target[y0:y1, x0:x1] = normalize_frame(frame_callback(params), (y1 - y0, x1 - x0))
+
+                canvas.target.flush()
+                release_rows(canvas.source, y0, y1)
+                release_rows(canvas.target, y0, y1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a tone effect to a huge image tile by tile")
+    parser.add_argument("source", help=".npy file or raw RGB file (requires --shape)")
+    parser.add_argument("target", help=".npy or raw output file")
+    parser.add_argument("effect", choices=EFFECTS.keys())
+    parser.add_argument("-p", "--param", action="append", default=[], type=parse_param,
+                        help="effect parameter as name=value, e.g. -p depth=20 -p from=0.4")
+    parser.add_argument("-t", "--tile", type=int, default=DEFAULT_TILE, help="tile side in pixels")
+    parser.add_argument("-s", "--shape", type=int, nargs=2, metavar=("HEIGHT", "WIDTH"),
+                        help="image size of a raw source")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frame_cb = compile_effect(EFFECTS[args.effect](**dict(args.param)))
+    TiledCanvas.edit_tiles_by_cb(args.source, args.target, frame_cb, args.tile, args.shape)
+    print(f"Done in {time.perf_counter() - start:.2f}s")
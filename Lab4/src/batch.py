@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+import model
+
+
+def video_info(source):
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video {source}")
+    info = (
+        int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        cap.get(cv2.CAP_PROP_FPS) or 25.0,
+        (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))),
+    )
+    cap.release()
+    return info
+
+
+# [start, stop) frame ranges, a few per worker so that a slow segment does not keep the others idle.
+# OpenCV does not expose where the keyframes are, starts are rounded to the keyframe interval when it is given
+# so the seek of a segment does not have to decode the end of the previous group of pictures
+def split_segments(count, workers, keyframe_interval=1, per_worker=4):
+    length = max(-(-count // (workers * per_worker)), 1)
+    length = -(-length // keyframe_interval) * keyframe_interval
+    return [(start, min(start + length, count)) for start in range(0, count, length)]
+
+
+def segment_paths(tmp_dir, index, extension):
+    return os.path.join(tmp_dir, f"segment_{index:05}{extension}"), os.path.join(tmp_dir, f"segment_{index:05}.jsonl")
+
+
+# Runs in a worker process: the frames of [start, stop) to an annotated video and a json-lines file
+def process_segment(source, index, start, stop, tmp_dir, extension, fourcc, fps, size, crop):
+    video_path, boxes_path = segment_paths(tmp_dir, index, extension)
+    cap = cv2.VideoCapture(source)
+    # the seek decodes from the previous keyframe, so the first frame is exact
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    done = 0
+    with open(boxes_path, "w") as boxes_file:
+        for frame_index in range(start, stop):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            cars, boxes = model.track_cars(frame, crop)
+            out.write(cars)
+            boxes_file.write(json.dumps({"frame": frame_index, "time": round(frame_index / fps, 3),
+                                         "cars": [list(box) for box in boxes]}) + "\n")
+            done += 1
+    cap.release()
+    out.release()
+    return done
+
+
+def init_worker():
+    # the processes already use every core, OpenCV threads inside them would only compete
+    cv2.setNumThreads(1)
+
+
+# Segments are copied as they are with ffmpeg when it is installed, otherwise decoded and written again
+def stitch_videos(paths, out_file_name, fourcc, fps, size):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        list_file = f"{out_file_name}.segments.txt"
+        with open(list_file, "w") as file:
+            file.writelines(f"file '{os.path.abspath(path)}'\n" for path in paths)
+        try:
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file,
+                            "-c", "copy", out_file_name], check=True)
+        finally:
+            os.remove(list_file)
+        return
+
+    out = cv2.VideoWriter(out_file_name, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        cap.release()
+    out.release()
+
+
+def stitch_boxes(paths, boxes_file_name):
+    with open(boxes_file_name, "w") as out:
+        for path in paths:
+            with open(path) as file:
+                shutil.copyfileobj(file, out)
+
+
+def run_batch(source, out_file_name, boxes_file_name, workers=None, keyframe_interval=1, fourcc="mp4v",
+              crop=False):
+    workers = workers or os.cpu_count()
+    count, fps, size = video_info(source)
+    segments = split_segments(count, workers, keyframe_interval)
+    extension = os.path.splitext(out_file_name)[1]
+    print(f"|-Video: {source} {size[0]}x{size[1]}, {count} frames, {len(segments)} segments, {workers} workers")
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_file_name))) as tmp_dir:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = [
+                executor.submit(process_segment, source, index, segment_start, segment_stop, tmp_dir, extension,
+                                fourcc, fps, size, crop)
+                for index, (segment_start, segment_stop) in enumerate(segments)
+            ]
+            done = sum(future.result() for future in futures)
+        processed = time.perf_counter() - start
+
+        paths = [segment_paths(tmp_dir, index, extension) for index in range(len(segments))]
+        stitch_videos([video for video, _ in paths], out_file_name, fourcc, fps, size)
+        stitch_boxes([boxes for _, boxes in paths], boxes_file_name)
+
+    elapsed = time.perf_counter() - start
+    print(f"|---processed {done} frames in {processed:.2f}s ({done / processed:.1f} FPS), "
+          f"{elapsed:.2f}s with stitching")
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotate cars on a whole video without display")
+    parser.add_argument("source", help="input video")
+    parser.add_argument("-o", "--out", default="modified_example.mp4", help="annotated video")
+    parser.add_argument("-b", "--boxes", default=None, help="json-lines file of the car boxes of every frame")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="process pool size")
+    parser.add_argument("-k", "--keyframe-interval", type=int, default=1, help="frames between keyframes")
+    parser.add_argument("-f", "--fourcc", default="mp4v", help="codec of the annotated video")
+    parser.add_argument("-c", "--crop", action="store_true", help="run the filters on the road area only")
+    args = parser.parse_args()
+
+    boxes = args.boxes or f"{os.path.splitext(args.out)[0]}.jsonl"
+    run_batch(args.source, args.out, boxes, args.workers, args.keyframe_interval, args.fourcc, args.crop)
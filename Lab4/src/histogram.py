@@ -1,14 +1,76 @@
+import threading
+
+import cv2
 import numpy as np
 from matplotlib import pyplot as plt
 
+FLOAT32_EXACT = 2 ** 24
+
+
+# Counts of every level over all channels, calcHist keeps them in float32 that is exact below 2 ** 24
+def image_hist(img):
+    if img.size < FLOAT32_EXACT:
+        return cv2.calcHist([img.reshape(-1, 1)], [0], None, [256], [0, 256]).ravel()
+    return np.bincount(img.ravel(), minlength=256)
+
+
+# Equalization table of a histogram: level -> equalized level
+def hist_lut(hist):
+    cdf = np.cumsum(hist, dtype=np.float64)
+    used = cdf > 0
+    cdf_min, cdf_max = cdf[used][0], cdf[-1]
+    if cdf_max == cdf_min:
+        return np.zeros(256, dtype=np.uint8)
+    lut = ((cdf - cdf_min) * 255 / (cdf_max - cdf_min)).astype(np.uint8)
+    lut[~used] = 0
+    return lut
+
+
+# Equalization table of the image: level -> equalized level
+def equalization_lut(img):
+    return hist_lut(image_hist(img))
+
 
 def hist_correction(img):
-    hist, *_ = np.histogram(img.flatten(), 256, [0, 256])
-    cdf = hist.cumsum()
-    cdf_m = np.ma.masked_equal(cdf, 0)
-    cdf_m = (cdf_m - cdf_m.min()) * 255 / (cdf_m.max() - cdf_m.min())
-    cdf = np.ma.filled(cdf_m, 0).astype('uint8')
-    return cdf[img]
+    return cv2.LUT(img, equalization_lut(img))
+
+
+# Equalization for video: the table comes from a decayed running histogram of the frames
+# and is only rebuilt when that histogram moved more than threshold (L1 distance of the normalized histograms).
+# The running histogram is smooth anyway, so it only counts every sample_step-th row and column.
+class TemporalEqualizer:
+    decay: float
+    threshold: float
+    sample_step: int
+    running: np.array or None
+    lut: np.array or None
+    lut_hist: np.array or None
+    rebuilds: int
+
+    def __init__(self, decay=0.9, threshold=0.05, sample_step=4):
+        self.decay = decay
+        self.threshold = threshold
+        self.sample_step = sample_step
+        self.running = self.lut = self.lut_hist = None
+        self.rebuilds = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, img):
+        hist = image_hist(img[::self.sample_step, ::self.sample_step]).astype(np.float64)
+        hist /= hist.sum()
+        with self.lock:
+            if self.running is None:
+                self.running = hist
+            else:
+                self.running = self.decay * self.running + (1 - self.decay) * hist
+            if self.lut is None or np.abs(self.running - self.lut_hist).sum() > self.threshold:
+                self.lut = hist_lut(self.running)
+                self.lut_hist = self.running
+                self.rebuilds += 1
+            return self.lut
+
+    def correct(self, img):
+        return cv2.LUT(img, self(img))
 
 
 def show_hist(img):
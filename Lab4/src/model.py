@@ -7,17 +7,41 @@ X_CROP_OFFSET = 200
 MAX_CAR_WIDTH = 150
 MIN_CAR_WIDTH = 20
 MAX_DISTANT = 310
-
-
-# use black mask to unused areas
-def mask_image(img):
-    img = histogram.hist_correction(img)
-    h, w, *_ = img.shape
-    mask = np.zeros((h, w), dtype=np.uint8)
-    points = np.array([[[0, 0], [0, h], [90, h], [440, 295], [600, 295], [1140, h], [w, h], [w, 0], [0, 0]]])
-    cv2.fillPoly(mask, points, (255))
-    img[mask > 0] = 255
-    return img
+# Pixels kept around the road when cropping, wider than the reach of all filters of image_procession together
+ROI_MARGIN = 16
+
+# Road masks by frame shape: (mask with 255 on unused areas, road bounding box with margin)
+road_masks = {}
+
+
+def road_mask(shape):
+    if shape not in road_masks:
+        h, w, *_ = shape
+        mask = np.zeros((h, w), dtype=np.uint8)
+        points = np.array([[[0, 0], [0, h], [90, h], [440, 295], [600, 295], [1140, h], [w, h], [w, 0], [0, 0]]])
+        cv2.fillPoly(mask, points, (255))
+
+        x, y, roi_w, roi_h = cv2.boundingRect(cv2.bitwise_not(mask))
+        x0, y0 = max(x - ROI_MARGIN, 0), max(y - ROI_MARGIN, 0)
+        x1, y1 = min(x + roi_w + ROI_MARGIN, w), min(y + roi_h + ROI_MARGIN, h)
+        if len(shape) == 3:
+            mask = cv2.merge([mask] * shape[2])
+        road_masks[shape] = mask, (x0, y0, x1 - x0, y1 - y0)
+    return road_masks[shape]
+
+
+# use black mask to unused areas, only the roi part is returned when it is given
+# equalizer gives the equalization table of the frame, histogram.TemporalEqualizer keeps one across video frames
+def mask_image(img, roi=None, equalizer=None):
+    # the histogram is always taken from the whole frame, so cropping does not change the result
+    lut = (equalizer or histogram.equalization_lut)(img)
+    mask, _ = road_mask(img.shape)
+    if roi is not None:
+        x, y, w, h = roi
+        img = img[y:y + h, x:x + w]
+        mask = mask[y:y + h, x:x + w]
+    # the mask is 0 or 255, so max sets the unused areas to 255 and keeps the rest
+    return cv2.max(cv2.LUT(img, lut), mask)
 
 
 # Change contrast and brightness
@@ -26,10 +50,11 @@ def adjust_contrast_brightness(img, contrast: float = 1.0, brightness: int = 0):
     return cv2.addWeighted(img, contrast, img, 0, brightness)
 
 
-# Cars identification
-def image_ident(init_img, processed_img, additional_contours=False):
+# Cars identification, also returns the (x, y, w, h) box of every car found
+# offset is the position of processed_img inside init_img when it was cropped
+def image_cars(init_img, processed_img, additional_contours=False, offset=(0, 0)):
     img_h, img_w, *_ = init_img.shape
-    contours = cv2.findContours(processed_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    contours = cv2.findContours(processed_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)[0]
     ident_image = init_img.copy()
 
     relative_koef = MIN_CAR_WIDTH * (img_h - MAX_CAR_WIDTH) / (MAX_CAR_WIDTH * MAX_DISTANT)
@@ -37,7 +62,7 @@ def image_ident(init_img, processed_img, additional_contours=False):
     upper_bound = MAX_CAR_WIDTH * 1 / relative_koef
     is_in_bound = lambda x: lower_bound < x < upper_bound
 
-    counter = 1
+    boxes = []
     for contour in contours:
         x, y, w, h = cv2.boundingRect(contour)
         if additional_contours:
@@ -55,9 +80,15 @@ def image_ident(init_img, processed_img, additional_contours=False):
             continue
 
         cv2.rectangle(ident_image, (x, y), (x + w - 1, y + h - 1), 255, 2)
-        cv2.putText(ident_image, f'Car #{counter}', (x, y - 10), cv2.FONT_HERSHEY_TRIPLEX, 0.5,
+        boxes.append((x, y, w, h))
+        cv2.putText(ident_image, f'Car #{len(boxes)}', (x, y - 10), cv2.FONT_HERSHEY_TRIPLEX, 0.5,
                     (0, 0, 255), 1, cv2.LINE_AA)
-        counter += 1
+    return ident_image, boxes
+
+
+# Cars identification
+def image_ident(init_img, processed_img, additional_contours=False, offset=(0, 0)):
+    ident_image, _ = image_cars(init_img, processed_img, additional_contours, offset)
     return ident_image
 
 
@@ -96,8 +127,21 @@ def image_procession(img):
     return transformed_image
 
 
-# Final api function that allows track cars
-def follow_cars(img):
-    masked_image = mask_image(img)
+# Annotated image and the boxes of the cars
+# With crop the filters only run on the bounding box of the road, the result is the same
+def track_cars(img, crop=False, equalizer=None):
+    if not crop:
+        masked_image = mask_image(img, equalizer=equalizer)
+        processed_image = image_procession(masked_image)
+        return image_cars(img, processed_image, additional_contours=False)
+
+    _, roi = road_mask(img.shape)
+    masked_image = mask_image(img, roi, equalizer)
     processed_image = image_procession(masked_image)
-    return image_ident(img, processed_image, additional_contours=False)
+    return image_cars(img, processed_image, additional_contours=False, offset=roi[:2])
+
+
+# Final api function that allows track cars
+def follow_cars(img, crop=False, equalizer=None):
+    ident_image, _ = track_cars(img, crop, equalizer)
+    return ident_image
@@ -0,0 +1,195 @@
+import argparse
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+from queue import Queue, Empty, Full
+
+import cv2
+
+import histogram
+import model
+
+
+# Decode, detect and render run on their own threads, so their latencies overlap instead of adding up.
+# OpenCV releases the GIL inside its calls, so several detection workers do run in parallel.
+# Live mode drops the oldest waiting frame when detection falls behind, offline mode keeps every frame.
+class VideoPipeline:
+    source: str or int
+    process: callable
+    workers: int
+    live: bool
+    frames: Queue
+    results: Queue
+
+    # statistics
+    decoded: int
+    dropped: int
+    emitted: int
+    frames_depth: list[int]
+    results_depth: list[int]
+
+    def __init__(self, source, process=model.follow_cars, workers=None, queue_size=8, live=False):
+        self.source = source
+        self.process = process
+        self.workers = workers or os.cpu_count()
+        self.live = live
+        self.frames = Queue(maxsize=queue_size)
+        # bounded as well, a slow render makes the workers and then the decoder wait
+        self.results = Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.take_lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.decoded = self.dropped = self.emitted = 0
+        self.frames_depth = []
+        self.results_depth = []
+
+    # Live mode never waits for a frame: the oldest waiting one is dropped at once so decoding keeps the source pace
+    def put_frame(self, item):
+        wait = not self.live or item is None
+        while not self.stop.is_set():
+            try:
+                if wait:
+                    self.frames.put(item, timeout=0.1)
+                else:
+                    self.frames.put_nowait(item)
+                return
+            except Full:
+                if not wait:
+                    try:
+                        self.frames.get_nowait()
+                        self.dropped += 1
+                    except Empty:
+                        pass
+
+    def put_result(self, item):
+        while not self.stop.is_set():
+            try:
+                self.results.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def decode(self):
+        cap = cv2.VideoCapture(self.source)
+        try:
+            while cap.isOpened() and not self.stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                self.put_frame((self.decoded, frame))
+                self.decoded += 1
+        finally:
+            cap.release()
+            for _ in range(self.workers):
+                self.put_frame(None)
+
+    def detect(self):
+        try:
+            while not self.stop.is_set():
+                # frames are numbered when taken, so the dropped ones leave no gaps in the output order
+                with self.take_lock:
+                    try:
+                        item = self.frames.get(timeout=0.1)
+                    except Empty:
+                        continue
+                    sequence = next(self.sequence)
+                if item is None:
+                    break
+                index, frame = item
+                try:
+                    self.put_result((sequence, index, self.process(frame), None))
+                except Exception as error:
+                    # the failure takes the place of the frame, __iter__ raises it in order
+                    self.put_result((sequence, index, None, error))
+                    break
+        finally:
+            self.put_result(None)
+
+    # Yields (frame index, processed frame) in decode order
+    def __iter__(self):
+        threads = [threading.Thread(target=self.decode, daemon=True)]
+        threads += [threading.Thread(target=self.detect, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        pending = []
+        finished = 0
+        try:
+            while finished < self.workers:
+                result = self.results.get()
+                if result is None:
+                    finished += 1
+                    continue
+                heapq.heappush(pending, result)
+                while pending and pending[0][0] == self.emitted:
+                    _, index, processed, error = heapq.heappop(pending)
+                    if error is not None:
+                        raise error
+                    self.frames_depth.append(self.frames.qsize())
+                    self.results_depth.append(len(pending) + self.results.qsize())
+                    self.emitted += 1
+                    yield index, processed
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join(timeout=1)
+
+    def report(self, elapsed):
+        depth = lambda values: f"mean {sum(values) / max(len(values), 1):.1f}, max {max(values, default=0)}"
+        print(f"Frames: decoded {self.decoded}, shown {self.emitted}, dropped {self.dropped}")
+        print(f"End-to-end: {self.emitted / elapsed:.1f} FPS over {elapsed:.2f}s with {self.workers} workers")
+        print(f"Decoded queue depth: {depth(self.frames_depth)}")
+        print(f"Reorder queue depth: {depth(self.results_depth)}")
+
+
+def run(source, workers=None, queue_size=8, live=False, show=True, out_file_name=None, crop=False,
+        temporal=False):
+    equalizer = histogram.TemporalEqualizer() if temporal else None
+    process = functools.partial(model.follow_cars, crop=crop, equalizer=equalizer)
+    pipeline = VideoPipeline(source, process, workers=workers, queue_size=queue_size, live=live)
+    out = None
+    start = time.perf_counter()
+    for _, cars in pipeline:
+        if out_file_name is not None:
+            if out is None:
+                h, w, *_ = cars.shape
+                out = cv2.VideoWriter(out_file_name, cv2.VideoWriter_fourcc(*"mp4v"), 20.0, (w, h))
+            out.write(cars)
+        if show:
+            cv2.imshow("Cars", cars)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    elapsed = time.perf_counter() - start
+
+    if out is not None:
+        out.release()
+    if show:
+        cv2.destroyAllWindows()
+    pipeline.report(elapsed)
+    if equalizer is not None:
+        print(f"Equalization table rebuilt {equalizer.rebuilds} times")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track cars on a video with pipelined decode / detect / render")
+    parser.add_argument("source", nargs="?", default="example.mp4", help="video file or camera index")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="detection threads")
+    parser.add_argument("-q", "--queue-size", type=int, default=8, help="decoded frames waiting for detection")
+    parser.add_argument("-l", "--live", action="store_true", help="drop stale frames instead of waiting")
+    parser.add_argument("-o", "--out", default=None, help="write the annotated video to this file")
+    parser.add_argument("-c", "--crop", action="store_true", help="run the filters on the road area only")
+    parser.add_argument("-t", "--temporal", action="store_true",
+                        help="equalize with a running histogram of the video instead of each frame alone")
+    parser.add_argument("--no-show", dest="show", action="store_false")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings at exit (or on SIGUSR1)")
+    args = parser.parse_args()
+
+    if args.profile:
+        import timing
+        timing.enable()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    run(source, args.workers, args.queue_size, args.live, args.show, args.out, args.crop, args.temporal)
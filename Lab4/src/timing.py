@@ -0,0 +1,136 @@
+import atexit
+import functools
+import signal
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import histogram
+import model
+
+CAPACITY = 1024
+PERCENTILES = (50, 95, 99)
+
+
+def array_size(result):
+    return result.size
+
+
+# Stages to time: their module, the function name and how to measure their output
+MODEL_STAGES = {
+    "mask_image": array_size,
+    "image_procession": array_size,
+    "image_cars": lambda result: len(result[1]),
+}
+HISTOGRAM_STAGES = {
+    "equalization_lut": array_size,
+}
+CV2_STAGES = {
+    "blur": array_size,
+    "filter2D": array_size,
+    "GaussianBlur": array_size,
+    "Canny": array_size,
+    "morphologyEx": array_size,
+    "findContours": lambda result: len(result[0]),
+}
+
+
+# Wall times and output sizes of the last CAPACITY calls of one stage
+class StageStats:
+    times: np.array
+    sizes: np.array
+    calls: int
+
+    def __init__(self, capacity=CAPACITY):
+        self.times = np.zeros(capacity)
+        self.sizes = np.zeros(capacity, dtype=np.int64)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def record(self, elapsed, size):
+        with self.lock:
+            position = self.calls % len(self.times)
+            self.times[position] = elapsed
+            self.sizes[position] = size
+            self.calls += 1
+
+    def window(self):
+        count = min(self.calls, len(self.times))
+        return self.times[:count], self.sizes[:count]
+
+    def percentiles(self):
+        times, _ = self.window()
+        return np.percentile(times, PERCENTILES) if len(times) else np.zeros(len(PERCENTILES))
+
+
+stats: dict[str, StageStats] = {}
+# (module, name, original function) of everything replaced while enabled
+patched = []
+
+
+def timed(name, func, size):
+    stage = stats.setdefault(name, StageStats())
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        stage.record(time.perf_counter() - start, size(result))
+        return result
+
+    return wrapper
+
+
+# Forwards to cv2, with the timed stages replaced, so only the calls made by model.py are measured
+class TimedModule:
+    def __init__(self, module, stages):
+        self._module = module
+        for name, size in stages.items():
+            setattr(self, name, timed(name, getattr(module, name), size))
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+def summary():
+    lines = [f"{'stage':18}| calls | p50 ms | p95 ms | p99 ms | mean output size"]
+    for name, stage in stats.items():
+        if not stage.calls:
+            continue
+        p50, p95, p99 = stage.percentiles() * 1000
+        _, sizes = stage.window()
+        lines.append(f"{name:18}| {stage.calls:5} | {p50:6.2f} | {p95:6.2f} | {p99:6.2f} | {sizes.mean():.0f}")
+    return "\n".join(lines)
+
+
+def dump(*_):
+    print(summary())
+
+
+# Replaces the stage functions by timed wrappers, nothing is measured and nothing is slower until this is called.
+# The summary is printed at exit and, where the platform has it, on SIGUSR1.
+def enable(dump_at_exit=True):
+    if patched:
+        return
+    for module, stages in [(model, MODEL_STAGES), (histogram, HISTOGRAM_STAGES)]:
+        for name, size in stages.items():
+            patched.append((module, name, getattr(module, name)))
+            setattr(module, name, timed(name, getattr(module, name), size))
+    patched.append((model, "cv2", model.cv2))
+    model.cv2 = TimedModule(cv2, CV2_STAGES)
+
+    if dump_at_exit:
+        atexit.register(dump)
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, dump)
+
+
+def disable():
+    while patched:
+        module, name, original = patched.pop()
+        setattr(module, name, original)
+    atexit.unregister(dump)
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
@@ -0,0 +1,199 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import model
+
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3, criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+FEATURE_PARAMS = dict(maxCorners=20, qualityLevel=0.01, minDistance=5)
+# Boxes overlapping more than this are the same car
+MATCH_IOU = 0.3
+AGREEMENT_IOU = 0.5
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    return w * h / (aw * ah + bw * bh - w * h)
+
+
+# Greedy one to one matching, best overlaps first: [(index in boxes_a, index in boxes_b)]
+def match_boxes(boxes_a, boxes_b, threshold):
+    pairs = sorted(((iou(a, b), i, j) for i, a in enumerate(boxes_a) for j, b in enumerate(boxes_b)), reverse=True)
+    used_a, used_b, matches = set(), set(), []
+    for overlap, i, j in pairs:
+        if overlap < threshold:
+            break
+        if i not in used_a and j not in used_b:
+            used_a.add(i)
+            used_b.add(j)
+            matches.append((i, j))
+    return matches
+
+
+# Corners inside the box to follow with optical flow, the box center when it has none
+def box_points(gray, box):
+    x, y, w, h = box
+    corners = cv2.goodFeaturesToTrack(gray[y:y + h, x:x + w], **FEATURE_PARAMS)
+    if corners is None:
+        return np.array([[[x + w / 2, y + h / 2]]], dtype=np.float32)
+    return corners + np.array([x, y], dtype=np.float32)
+
+
+class Track:
+    id: int
+    box: np.array
+    points: np.array
+
+    def __init__(self, id, box, points):
+        self.id = id
+        self.box = np.array(box, dtype=np.float32)
+        self.points = points
+
+    def int_box(self):
+        return tuple(int(round(value)) for value in self.box)
+
+
+# Full detection every detect_every frames, or earlier when too many tracked points are lost.
+# In between the boxes follow the median optical flow of the corners found inside them,
+# a car keeps its id while the next detection overlaps its tracked box.
+class HybridTracker:
+    detect_every: int
+    min_confidence: float
+    crop: bool
+    tracks: list[Track]
+
+    # statistics
+    frames: int
+    detections: int
+
+    def __init__(self, detect_every=5, min_confidence=0.6, crop=False):
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.crop = crop
+        self.tracks = []
+        self.next_id = 1
+        self.prev_gray = None
+        self.since_detection = 0
+        self.detected_points = 0
+        self.frames = self.detections = 0
+
+    def detect(self, frame, gray):
+        _, boxes = model.track_cars(frame, self.crop)
+        ids = {j: self.tracks[i].id for i, j in match_boxes([t.box for t in self.tracks], boxes, MATCH_IOU)}
+        tracks = []
+        for j, box in enumerate(boxes):
+            if j not in ids:
+                ids[j] = self.next_id
+                self.next_id += 1
+            tracks.append(Track(ids[j], box, box_points(gray, box)))
+        self.tracks = tracks
+        self.detected_points = sum(len(track.points) for track in tracks)
+        self.since_detection = 0
+        self.detections += 1
+
+    # Moves every box with its points, returns the share of the detected points still tracked
+    def propagate(self, gray):
+        if not self.tracks:
+            return 1.0
+        points = np.concatenate([track.points for track in self.tracks])
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None, **LK_PARAMS)
+        status = status.ravel().astype(bool)
+
+        start = 0
+        for track in self.tracks:
+            stop = start + len(track.points)
+            good = status[start:stop]
+            if good.any():
+                shift = np.median(moved[start:stop][good] - track.points[good], axis=0).ravel()
+                track.box[:2] += shift
+                track.points = moved[start:stop][good]
+            start = stop
+        self.since_detection += 1
+        return status.sum() / self.detected_points if self.detected_points else 1.0
+
+    def draw(self, frame):
+        ident_image = frame.copy()
+        for track in self.tracks:
+            x, y, w, h = track.int_box()
+            cv2.rectangle(ident_image, (x, y), (x + w - 1, y + h - 1), 255, 2)
+            cv2.putText(ident_image, f'Car #{track.id}', (x, y - 10), cv2.FONT_HERSHEY_TRIPLEX, 0.5,
+                        (0, 0, 255), 1, cv2.LINE_AA)
+        return ident_image
+
+    # Annotated frame and {car id: (x, y, w, h)}
+    def update(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detect = self.prev_gray is None or self.since_detection + 1 >= self.detect_every
+        if not detect:
+            detect = self.propagate(gray) < self.min_confidence
+        if detect:
+            self.detect(frame, gray)
+        self.prev_gray = gray
+        self.frames += 1
+        return self.draw(frame), {track.id: track.int_box() for track in self.tracks}
+
+
+# Share of boxes both ways that have a match, 1 when neither side has any box
+def agreement(reference, boxes):
+    if not reference and not boxes:
+        return 1.0
+    return 2 * len(match_boxes(reference, boxes, AGREEMENT_IOU)) / (len(reference) + len(boxes))
+
+
+def read_frames(source):
+    cap = cv2.VideoCapture(source)
+    frames = []
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+# FPS of full per-frame detection and of the hybrid mode, and how well their boxes agree
+def compare(source, detect_every=5, min_confidence=0.6, crop=False):
+    frames = read_frames(source)
+
+    start = time.perf_counter()
+    reference = [model.track_cars(frame, crop)[1] for frame in frames]
+    full_time = time.perf_counter() - start
+
+    tracker = HybridTracker(detect_every, min_confidence, crop)
+    start = time.perf_counter()
+    tracked = [list(tracker.update(frame)[1].values()) for frame in frames]
+    hybrid_time = time.perf_counter() - start
+
+    scores = [agreement(ref, boxes) for ref, boxes in zip(reference, tracked)]
+    print(f"|-Video: {source}, {len(frames)} frames, detection every {detect_every} frames")
+    print(f"|---full detection: {len(frames) / full_time:.1f} FPS")
+    print(f"|---hybrid: {len(frames) / hybrid_time:.1f} FPS, x{full_time / hybrid_time:.2f}, "
+          f"{tracker.detections} detections, {tracker.next_id - 1} car ids")
+    print(f"|---agreement with full detection (IoU > {AGREEMENT_IOU}): mean {np.mean(scores):.3f}, "
+          f"min {np.min(scores):.3f}")
+    return full_time, hybrid_time, scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare detect-every-N-frames tracking with full detection")
+    parser.add_argument("source", nargs="?", default="example.mp4")
+    parser.add_argument("-n", "--detect-every", type=int, default=5)
+    parser.add_argument("-m", "--min-confidence", type=float, default=0.6,
+                        help="share of tracked points below which detection runs early")
+    parser.add_argument("-c", "--crop", action="store_true", help="run the filters on the road area only")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings at exit (or on SIGUSR1)")
+    args = parser.parse_args()
+
+    if args.profile:
+        import timing
+        timing.enable()
+
+    compare(args.source, args.detect_every, args.min_confidence, args.crop)
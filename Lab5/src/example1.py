@@ -1,4 +1,5 @@
 import cv2 as cv
+import numpy as np
 import utils
 
 
@@ -23,37 +24,38 @@ def prepare_image(initial):
     return dilated
 
 
-def ident_solar_panels(initial):
-    # cv.imshow("Initial example1", initial)
+# Boxes of the panels as x, y, w, h arrays, site is the json file with the exclusion polygons of the place.
+# A tile of a bigger image passes its position in the image as offset and the exclusion mask of its own area.
+def find_panels(initial, site=utils.DEFAULT_SITE, offset=(0, 0), exclusions=None):
+    return contour_panels(prepare_image(initial), site, offset, exclusions)
 
-    prepared = prepare_image(initial)
-    contours, hierarchies = cv.findContours(prepared, cv.RETR_TREE, cv.CHAIN_APPROX_NONE)
-    contoured = initial.copy()
-    solar_panel_area = 0
 
-    for contour in contours:
-        x, y, w, h = cv.boundingRect(contour)
-        area = cv.contourArea(contour)
-        perimeter = cv.arcLength(contour, True)
-        rect_area = w * h
+# Boxes of the panels among the contours of the prepared image
+def contour_panels(prepared, site=utils.DEFAULT_SITE, offset=(0, 0), exclusions=None):
+    if exclusions is None:
+        exclusions = utils.exclusion_mask(prepared.shape, site)
 
-        if w > 55 or h > 55 or w < 10 or h < 10:
-            continue
+    contours, hierarchies = cv.findContours(prepared, cv.RETR_TREE, cv.CHAIN_APPROX_NONE, offset=offset)
 
-        if area > 2500 or area < 150:
-            continue
+    x, y, w, h = utils.contour_boxes(contours)
+    is_panel = (w <= 55) & (h <= 55) & (w >= 10) & (h >= 10)
+    is_panel &= (h >= w / 3) & (w >= h / 3)
+    is_panel &= ~utils.are_excluded(x - offset[0], y - offset[1], exclusions)
 
-        if perimeter > 220 or perimeter < 40:
-            continue
+    # area and perimeter are only measured on the contours that passed the box rules
+    candidates = np.flatnonzero(is_panel)
+    area, perimeter = utils.contour_shapes([contours[i] for i in candidates])
+    is_panel[candidates] = (area <= 2500) & (area >= 150) & (perimeter <= 220) & (perimeter >= 40)
+    return x[is_panel], y[is_panel], w[is_panel], h[is_panel]
 
-        if h < w / 3 or w < h / 3:
-            continue
 
-        if utils.is_not_in_mask(x, y):
-            continue
+def ident_solar_panels(initial, site=utils.DEFAULT_SITE):
+    # cv.imshow("Initial example1", initial)
 
-        cv.rectangle(contoured, (x, y), (x + w, y + h), (0, 0, 255), thickness=2)
-        solar_panel_area += rect_area
+    contoured = initial.copy()
+    x, y, w, h = find_panels(initial, site)
+    utils.draw_panels(contoured, x, y, w, h)
+    solar_panel_area = int((w * h).sum())
 
     panels_number = utils.area_to_panel(solar_panel_area)
     return contoured, panels_number
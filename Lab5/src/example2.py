@@ -1,12 +1,20 @@
 import cv2 as cv
+import numpy as np
 import utils
 
 
-def prepare_image(init):
+# sampled uses utils.k_means_sampled, warm started from the last palette of the same site,
+# a given palette is applied as it is
+def prepare_image(init, sampled=False, site=None, palette=None):
     adjusted = utils.adjust_contrast_and_brightness(init, contrast=3, brightness=50)
     # cv.imshow("Contrast and brightness", adjusted)
 
-    k_means = utils.k_means(adjusted, k=10)
+    if palette is not None:
+        k_means = utils.apply_palette(adjusted, palette)
+    elif sampled:
+        k_means = utils.k_means_sampled(adjusted, k=10, key=site)
+    else:
+        k_means = utils.k_means(adjusted, k=10)
     # cv.imshow("K-means", k_means)
 
     gray = cv.cvtColor(k_means, cv.COLOR_BGR2GRAY)
@@ -24,35 +32,37 @@ def prepare_image(init):
     return opening
 
 
-def ident_solar_panels(initial):
-    # cv.imshow("Initial example 2", initial)
+# Boxes of the panels as x, y, w, h arrays, site is the json file with the exclusion polygons of the place.
+# A tile of a bigger image passes its position in the image as offset and the exclusion mask of its own area.
+def find_panels(initial, site=utils.DEFAULT_SITE, sampled=False, offset=(0, 0), exclusions=None, palette=None):
+    return contour_panels(prepare_image(initial, sampled, site, palette), site, offset, exclusions)
 
-    prepared = prepare_image(initial)
-    contours, hierarchies = cv.findContours(prepared, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
-    contoured = initial.copy()
-    solar_panel_area = 0
 
-    for contour in contours:
-        x, y, w, h = cv.boundingRect(contour)
-        area = cv.contourArea(contour)
-        perimeter = cv.arcLength(contour, True)
-        rect_area = w * h
+# Boxes of the panels among the contours of the prepared image
+def contour_panels(prepared, site=utils.DEFAULT_SITE, offset=(0, 0), exclusions=None):
+    if exclusions is None:
+        exclusions = utils.exclusion_mask(prepared.shape, site)
 
-        if w > 55 or h > 55 or w < 10 or h < 10:
-            continue
+    contours, hierarchies = cv.findContours(prepared, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE, offset=offset)
 
-        if area > 2500 or area < 100:
-            continue
+    x, y, w, h = utils.contour_boxes(contours)
+    is_panel = (w <= 55) & (h <= 55) & (w >= 10) & (h >= 10)
+    is_panel &= ~utils.are_excluded(x - offset[0], y - offset[1], exclusions)
 
-        if perimeter > 400 or perimeter < 40:
-            continue
+    # area and perimeter are only measured on the contours that passed the box rules
+    candidates = np.flatnonzero(is_panel)
+    area, perimeter = utils.contour_shapes([contours[i] for i in candidates])
+    is_panel[candidates] = (area <= 2500) & (area >= 100) & (perimeter <= 400) & (perimeter >= 40)
+    return x[is_panel], y[is_panel], w[is_panel], h[is_panel]
 
-        if utils.is_not_in_mask(x, y):
-            continue
 
-        # cv.drawContours(contoured, [contour], -1, (0, 255, 0), thickness=2)
-        cv.rectangle(contoured, (x, y), (x + w, y + h), (0, 0, 255), thickness=2)
-        solar_panel_area += rect_area
+def ident_solar_panels(initial, site=utils.DEFAULT_SITE, sampled=False):
+    # cv.imshow("Initial example 2", initial)
+
+    contoured = initial.copy()
+    x, y, w, h = find_panels(initial, site, sampled)
+    utils.draw_panels(contoured, x, y, w, h)
+    solar_panel_area = int((w * h).sum())
 
     panels_number = utils.area_to_panel(solar_panel_area)
     return contoured, panels_number
@@ -0,0 +1,65 @@
+import argparse
+import time
+
+import cv2 as cv
+import numpy as np
+
+import example2
+import utils
+
+
+def distortion(img, quantized):
+    return float(np.mean((img.astype(np.float32) - quantized) ** 2))
+
+
+def timed_sampled(adjusted, k, sample_size, key=None):
+    start = time.perf_counter()
+    palette = utils.fit_palette(adjusted, k, sample_size, key)
+    quantized = utils.apply_palette(adjusted, palette)
+    return palette, quantized, time.perf_counter() - start
+
+
+def palette_panels(initial, site, palette):
+    x, y, w, h = example2.find_panels(initial, site, palette=palette)
+    return utils.area_to_panel(int((w * h).sum()))
+
+
+# Time and mean squared error of every quantizer on the adjusted image example2 quantizes,
+# and the panels example2 counts with it. The warm fit of an image starts from the cold palette
+# of the image before it (the first one from the last one), as a survey of the site would.
+def compare(file_names, k=10, sample_size=20000, site=utils.DEFAULT_SITE):
+    initials = [cv.imread(file_name) for file_name in file_names]
+    adjusted = [utils.adjust_contrast_and_brightness(initial, contrast=3, brightness=50) for initial in initials]
+    colds = [timed_sampled(image, k, sample_size) for image in adjusted]
+
+    print(f"{'image':16}| {'quantizer':13}| time ms |    mse | panels")
+    for i, (file_name, initial, image) in enumerate(zip(file_names, initials, adjusted)):
+        cv.setRNGSeed(0)
+        start = time.perf_counter()
+        quantized = utils.k_means(image, k)
+        elapsed = time.perf_counter() - start
+        cv.setRNGSeed(0)
+        _, panels = example2.ident_solar_panels(initial, site)
+        rows = [("k_means", elapsed, quantized, panels)]
+
+        palette, quantized, elapsed = colds[i]
+        rows.append(("sampled", elapsed, quantized, palette_panels(initial, site, palette)))
+        if len(file_names) > 1:
+            utils.palettes[site] = colds[i - 1][0]
+            palette, quantized, elapsed = timed_sampled(image, k, sample_size, key=site)
+            rows.append(("sampled warm", elapsed, quantized, palette_panels(initial, site, palette)))
+
+        for name, elapsed, quantized, panels in rows:
+            print(f"{file_name:16}| {name:13}| {elapsed * 1000:7.1f} | {distortion(image, quantized):6.1f} | "
+                  f"{panels}")
+    utils.palettes.pop(site, None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed and quality of sampled k-means against full k-means")
+    parser.add_argument("files", nargs="*", default=["example1.png", "example2.png"])
+    parser.add_argument("-k", type=int, default=10, help="palette size")
+    parser.add_argument("-s", "--sample-size", type=int, default=20000, help="pixels the palette is fitted on")
+    args = parser.parse_args()
+
+    compare(args.files, args.k, args.sample_size)
@@ -0,0 +1,121 @@
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2 as cv
+
+import utils
+from tiled import PIPELINES
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+FIELDS = ["file", "pipeline", "panels", "boxes", "area_px",
+          "read_ms", "prepare_ms", "contours_ms", "write_ms", "total_ms", "error"]
+
+
+def iter_files(source):
+    if os.path.isdir(source):
+        with os.scandir(source) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield entry.path
+    else:
+        yield from sorted(glob.iglob(source, recursive=True))
+
+
+# Runs in a worker process: the csv row of one image, the annotated image is only written with out_dir.
+# An image that fails gets its error in the row instead of stopping the survey.
+def survey_image(file_name, pipeline, site, sampled, out_dir):
+    row = {"file": file_name, "pipeline": pipeline}
+    start = stage_start = time.perf_counter()
+
+    def stage(name):
+        nonlocal stage_start
+        now = time.perf_counter()
+        row[f"{name}_ms"] = round((now - stage_start) * 1000, 1)
+        stage_start = now
+
+    try:
+        initial = cv.imread(file_name)
+        if initial is None:
+            row["error"] = "cannot read image"
+            return row
+        stage("read")
+
+        module = PIPELINES[pipeline]
+        # sampled k-means is fitted on each image alone with a fixed seed, without the palettes of other images
+        # (no site key), so the counts do not depend on which worker surveyed which image before
+        options = dict(sampled=sampled) if pipeline == "example2" else {}
+        prepared = module.prepare_image(initial, **options)
+        stage("prepare")
+
+        x, y, w, h = module.contour_panels(prepared, site)
+        area = int((w * h).sum())
+        row.update(panels=utils.area_to_panel(area), boxes=len(x), area_px=area)
+        stage("contours")
+
+        if out_dir is not None:
+            contoured = initial.copy()
+            utils.draw_panels(contoured, x, y, w, h)
+            cv.imwrite(os.path.join(out_dir, os.path.basename(file_name)), contoured)
+            stage("write")
+    except Exception as error:
+        row["error"] = f"{type(error).__name__}: {' '.join(str(error).split())}"
+        return row
+    row["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return row
+
+
+# Rows are written as the images finish, so they come in completion order
+def run_survey(source, pipeline="example1", site=utils.DEFAULT_SITE, sampled=False, workers=None, out_dir=None,
+               out=sys.stdout):
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    writer = csv.DictWriter(out, FIELDS)
+    writer.writeheader()
+    count = 0
+    start = time.perf_counter()
+
+    def write(done):
+        nonlocal count
+        for future in done:
+            writer.writerow(future.result())
+            count += 1
+        out.flush()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for file_name in iter_files(source):
+            # at most a couple of images per worker are queued, the rest stay in the iterator
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(done)
+            pending.add(executor.submit(survey_image, file_name, pipeline, site, sampled, out_dir))
+        write(pending)
+
+    elapsed = time.perf_counter() - start
+    print(f"Surveyed {count} images in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.2f} images/s)",
+          file=sys.stderr)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count solar panels on many site images without display")
+    parser.add_argument("source", help="input directory or glob pattern")
+    parser.add_argument("-p", "--pipeline", choices=PIPELINES.keys(), default="example1")
+    parser.add_argument("-s", "--site", default=utils.DEFAULT_SITE, help="json file of the exclusion polygons")
+    parser.add_argument("--sampled", action="store_true", help="example2 with the sampled k-means quantizer")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="process pool size")
+    parser.add_argument("-a", "--annotated", default=None, help="write images with the panels marked to this directory")
+    parser.add_argument("-o", "--out", default=None, help="csv file, standard output by default")
+    args = parser.parse_args()
+
+    if args.out is None:
+        run_survey(args.source, args.pipeline, args.site, args.sampled, args.workers, args.annotated)
+    else:
+        with open(args.out, "w", newline="") as file:
+            run_survey(args.source, args.pipeline, args.site, args.sampled, args.workers, args.annotated, file)
@@ -0,0 +1,113 @@
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2 as cv
+import numpy as np
+
+import example1
+import example2
+import utils
+
+PIPELINES = {"example1": example1, "example2": example2}
+DEFAULT_TILE = 1024
+# Wider than the biggest panel (55 px) plus the reach of the filters of prepare_image,
+# so every panel found by a tile is also whole and identical in the tile whose core holds its corner
+DEFAULT_OVERLAP = 80
+
+
+# Cores of the tiles as (x0, y0, x1, y1), they cover the image without overlapping
+def tile_cores(h, w, tile_size):
+    return [(x0, y0, min(x0 + tile_size, w), min(y0 + tile_size, h))
+            for y0 in range(0, h, tile_size) for x0 in range(0, w, tile_size)]
+
+
+# Runs in a worker process: the panels of one tile whose top left corner is in the core of the tile
+def tile_panels(file_name, pipeline, core, overlap, site, palette):
+    image = np.load(file_name, mmap_mode="r")
+    height, width, *_ = image.shape
+    x0, y0, x1, y1 = core
+    left, top = max(x0 - overlap, 0), max(y0 - overlap, 0)
+    right, bottom = min(x1 + overlap, width), min(y1 + overlap, height)
+    tile = np.ascontiguousarray(image[top:bottom, left:right, :3])
+    del image
+
+    exclusions = utils.rasterize_exclusions(tile.shape, site, (left, top))
+    # example2 quantizes with the palette of the whole image, not one of its own
+    options = dict(palette=palette) if palette is not None else {}
+    x, y, w, h = PIPELINES[pipeline].find_panels(tile, site, offset=(left, top), exclusions=exclusions, **options)
+    # a panel near the border is also found by the neighbour tile, only the tile that owns its corner keeps it
+    own = (x0 <= x) & (x < x1) & (y0 <= y) & (y < y1)
+    return x[own], y[own], w[own], h[own]
+
+
+# Palette of example2 fitted once on pixels sampled from the whole image, so that all tiles share it
+def image_palette(image, sample_size=20000, seed=0):
+    h, w, *_ = image.shape
+    rng = np.random.default_rng(seed)
+    count = min(sample_size, h * w)
+    pixels = np.asarray(image[rng.integers(0, h, count), rng.integers(0, w, count), :3]).reshape(-1, 1, 3)
+    adjusted = utils.adjust_contrast_and_brightness(pixels, contrast=3, brightness=50)
+    return utils.fit_palette(adjusted, sample_size=sample_size, seed=seed)
+
+
+# Large images are read tile by tile from a .npy file, other formats are converted to one first
+def as_npy(file_name, tmp_dir):
+    if file_name.endswith(".npy"):
+        return file_name
+    npy_name = os.path.join(tmp_dir, "image.npy")
+    np.save(npy_name, cv.imread(file_name))
+    return npy_name
+
+
+def ident_solar_panels_tiled(file_name, pipeline="example1", site=utils.DEFAULT_SITE, tile_size=DEFAULT_TILE,
+                             overlap=DEFAULT_OVERLAP, workers=None, out_file_name=None):
+    workers = workers or os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        npy_name = as_npy(file_name, tmp_dir)
+        image = np.load(npy_name, mmap_mode="r")
+        height, width, *_ = image.shape
+        palette = image_palette(image) if pipeline == "example2" else None
+        cores = tile_cores(height, width, tile_size)
+        print(f"|-Image: {file_name} {width}x{height}, {len(cores)} tiles of {tile_size} px, {workers} workers")
+
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for core in cores:
+                # only a couple of tiles per worker wait in the queue
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results += [future.result() for future in done]
+                pending.add(executor.submit(tile_panels, npy_name, pipeline, core, overlap, site, palette))
+            results += [future.result() for future in pending]
+
+        x, y, w, h = (np.concatenate(values) for values in zip(*results))
+        if out_file_name is not None:
+            contoured = np.array(image[..., :3])
+            utils.draw_panels(contoured, x, y, w, h)
+            cv.imwrite(out_file_name, contoured)
+        del image
+
+    solar_panel_area = int((w * h).sum())
+    return utils.area_to_panel(solar_panel_area), (x, y, w, h)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count solar panels on a large image tile by tile")
+    parser.add_argument("source", help="image file, .npy files are read without loading them whole")
+    parser.add_argument("-p", "--pipeline", choices=PIPELINES.keys(), default="example1")
+    parser.add_argument("-s", "--site", default=utils.DEFAULT_SITE, help="json file of the exclusion polygons")
+    parser.add_argument("-t", "--tile", type=int, default=DEFAULT_TILE, help="tile side in pixels")
+    parser.add_argument("-v", "--overlap", type=int, default=DEFAULT_OVERLAP, help="pixels shared by neighbour tiles")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="process pool size")
+    parser.add_argument("-o", "--out", default=None, help="write the image with the panels marked")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    panels_number, boxes = ident_solar_panels_tiled(args.source, args.pipeline, args.site, args.tile, args.overlap,
+                                                    args.workers, args.out)
+    print(f"On the image approximately {panels_number} solar panels ({len(boxes[0])} boxes), "
+          f"{time.perf_counter() - start:.2f}s")
@@ -1,7 +1,13 @@
+import json
+import os
+from collections import OrderedDict
+
 from scipy import ndimage
 import cv2 as cv
 import numpy as np
 
+SITES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sites")
+DEFAULT_SITE = os.path.join(SITES_DIR, "example.json")
 KOEF_PIXEL_SQUARE_TO_PANEL = 9.2
 area_to_panel = lambda area: int(area * KOEF_PIXEL_SQUARE_TO_PANEL * 0.9)
 
@@ -37,16 +43,140 @@ def k_means(img, k=10):
     return res.reshape((img.shape))
 
 
+# Index of the nearest center of every pixel, in chunks so the distance table stays small
+def nearest_centers(pixels, centers, chunk_size=1 << 16):
+    labels = np.empty(len(pixels), dtype=np.int32)
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, and |p|^2 does not change the nearest center
+    squared = np.sum(centers * centers, axis=1)
+    for start in range(0, len(pixels), chunk_size):
+        chunk = pixels[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmin(squared - 2 * chunk @ centers.T, axis=1)
+    return labels
+
+
+# Palettes fitted by k_means_sampled by site or camera key, the start of the next fit with the same key
+palettes = {}
+
+
+# Palette of k colors fitted on a random sample of the pixels.
+# With a key that already has a palette the fit starts from it and runs once instead of with several attempts.
+def fit_palette(img, k=10, sample_size=20000, key=None, attempts=3, seed=0):
+    Z = np.float32(img.reshape((-1, 3)))
+    rng = np.random.default_rng(seed)
+    sample = Z[rng.choice(len(Z), min(sample_size, len(Z)), replace=False)]
+    criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    # k-means++ draws its first centers from the OpenCV generator
+    cv.setRNGSeed(seed)
+
+    palette = palettes.get(key)
+    if palette is not None and len(palette) == k:
+        labels = nearest_centers(sample, palette).reshape(-1, 1)
+        ret, label, center = cv.kmeans(sample, k, labels, criteria, 1, cv.KMEANS_USE_INITIAL_LABELS)
+    else:
+        ret, label, center = cv.kmeans(sample, k, None, criteria, attempts, cv.KMEANS_PP_CENTERS)
+    if key is not None:
+        palettes[key] = center
+    return center
+
+
+# Every pixel takes the color of its nearest palette center
+def apply_palette(img, center):
+    Z = np.float32(img.reshape((-1, 3)))
+    res = np.uint8(center)[nearest_centers(Z, center)]
+    return res.reshape((img.shape))
+
+
+# k_means fitted on a random sample of the pixels, then every pixel takes its nearest center
+def k_means_sampled(img, k=10, sample_size=20000, key=None, attempts=3, seed=0):
+    return apply_palette(img, fit_palette(img, k, sample_size, key, attempts, seed))
+
+
 def adjust_contrast_and_brightness(img, contrast: float = 1.0, brightness: int = 0):
     brightness += int(round(255 * (1 - contrast) / 2))
     return cv.addWeighted(img, contrast, img, 0, brightness)
 
 
-def is_not_in_mask(x, y):
-    return x < 215 and y > 270 or \
-        x > 120 and y < 80 or \
-        615 < x < 713 and y > 205 or \
-        515 < x < 620 and 125 < y < 420 or \
-        0 < x < 116 and y > 120 or \
-        410 < x < 620 and 140 < y < 310 or \
-        210 < x < 420 and y > 480
+# Areas of the site where panels are not counted, as polygons of [x, y] points in a json file
+def load_exclusions(site=DEFAULT_SITE):
+    with open(site) as file:
+        return [np.array(polygon, dtype=np.int32) for polygon in json.load(file)["exclusions"]]
+
+
+# Exclusion polygons of a site rasterized once per image size: 1 inside any polygon, 0 elsewhere.
+# Only the most recently used masks are kept, so images of many sizes do not pile up full-size masks.
+MAX_EXCLUSION_MASKS = 8
+exclusion_masks = OrderedDict()
+
+
+def exclusion_mask(shape, site=DEFAULT_SITE):
+    h, w, *_ = shape
+    key = (os.path.abspath(site), h, w)
+    if key in exclusion_masks:
+        exclusion_masks.move_to_end(key)
+        return exclusion_masks[key]
+
+    mask = exclusion_masks[key] = rasterize_exclusions(shape, site)
+    if len(exclusion_masks) > MAX_EXCLUSION_MASKS:
+        exclusion_masks.popitem(last=False)
+    return mask
+
+
+# Exclusion mask of the shape sized part of the image that starts at origin (x, y)
+def rasterize_exclusions(shape, site=DEFAULT_SITE, origin=(0, 0)):
+    h, w, *_ = shape
+    mask = np.zeros((h, w), dtype=np.uint8)
+    # one call per polygon, a single fillPoly call would leave the overlaps of polygons empty
+    for polygon in load_exclusions(site):
+        cv.fillPoly(mask, [polygon], 1, offset=(-origin[0], -origin[1]))
+    return mask
+
+
+# Which of the points (arrays of x and y inside the image) are in an excluded area
+def are_excluded(x, y, mask):
+    return mask[y, x].astype(bool)
+
+
+def contour_starts(contours):
+    lengths = np.fromiter((len(contour) for contour in contours), dtype=np.int64, count=len(contours))
+    starts = np.zeros(len(contours), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return starts, lengths
+
+
+# Bounding boxes of all contours at once as arrays, the values of cv.boundingRect
+def contour_boxes(contours):
+    if not len(contours):
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty, empty, empty
+    starts, _ = contour_starts(contours)
+    points = np.concatenate(contours).reshape(-1, 2)
+    low = np.minimum.reduceat(points, starts, axis=0)
+    high = np.maximum.reduceat(points, starts, axis=0)
+    x, y = low.T
+    w, h = (high - low + 1).T
+    return x, y, w, h
+
+
+# Areas and closed perimeters of the contours as arrays, the values of cv.contourArea and cv.arcLength(contour, True).
+# They cost a pass over every point, so they are meant for the contours left after the box rules.
+def contour_shapes(contours):
+    if not len(contours):
+        return np.zeros(0), np.zeros(0)
+    starts, lengths = contour_starts(contours)
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    xs, ys = points[:, 0], points[:, 1]
+
+    # every point is joined to the next one, the last point of a contour closes back to its first
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    next_xs, next_ys = xs[following], ys[following]
+    area = np.abs(np.add.reduceat(xs * next_ys - next_xs * ys, starts)) / 2
+    # OpenCV measures every segment in float32
+    segments = np.hypot(next_xs - xs, next_ys - ys, dtype=np.float32)
+    perimeter = np.add.reduceat(segments.astype(np.float64), starts)
+    return area, perimeter
+
+
+def draw_panels(img, x, y, w, h):
+    for i in range(len(x)):
+        cv.rectangle(img, (int(x[i]), int(y[i])), (int(x[i] + w[i]), int(y[i] + h[i])), (0, 0, 255), thickness=2)
@@ -0,0 +1,56 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+import utils
+from network import NeuralNetwork
+
+LAYERS = [784, 300, 100, 50, 20, 10]
+
+CONFIGS = [
+    ("float64, allocating", dict(dtype=np.float64, preallocate=False)),
+    ("float64, preallocated", dict(dtype=np.float64, preallocate=True)),
+    ("float32, preallocated", dict(dtype=np.float32, preallocate=True)),
+]
+
+
+# Peak memory allocated and released inside the training steps, as traced by tracemalloc (numpy reports its buffers there)
+def step_allocations(model, batches):
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for X, Y in batches:
+        model.train_batch(X, Y)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - baseline
+
+
+def benchmark_buffers(Xs, Ys, batch_size=32, steps=200):
+    batches = list(NeuralNetwork.batches(Xs, Ys, batch_size))
+    print(f"Layers {LAYERS}, batch {batch_size}, {len(batches)} steps per epoch")
+    print(f"{'config':24}| epoch s | peak transient bytes")
+    for name, config in CONFIGS:
+        np.random.seed(0)
+        model = NeuralNetwork(neuron_layers=LAYERS, **config)
+        # the first step allocates the buffers, it is not part of the steady state
+        model.train_batch(*batches[0])
+
+        start = time.perf_counter()
+        for X, Y in batches:
+            model.train_batch(X, Y)
+        elapsed = time.perf_counter() - start
+
+        transient = step_allocations(model, batches[:steps])
+        print(f"{name:24}| {elapsed:7.2f} | {transient:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Epoch time and allocation churn of the training loop")
+    parser.add_argument("-b", "--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    train_data, train_labels = utils.read_train_data()
+    benchmark_buffers(train_data, train_labels, args.batch_size)
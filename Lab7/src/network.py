@@ -0,0 +1,367 @@
+import os
+import numpy as np
+from typing import Callable
+
+# Model file: magic, uint32 [version, layers count, trained epochs, *layer sizes], then float32 W and B of every layer
+MODEL_MAGIC = b"NNET"
+MODEL_VERSION = 1
+
+
+def params_count(sizes):
+    return sum(next_n * n + next_n for n, next_n in zip(sizes[:-1], sizes[1:]))
+
+
+# Views of W and B of every layer inside one flat buffer, in the model file order
+def split_params(data, sizes):
+    Ws, Bs = [], []
+    position = 0
+    for n, next_n in zip(sizes[:-1], sizes[1:]):
+        Ws.append(data[position:position + next_n * n].reshape(next_n, n))
+        position += next_n * n
+        Bs.append(data[position:position + next_n].reshape(next_n, 1))
+        position += next_n
+    return Ws, Bs
+
+
+# Activation, delta and scratch arrays for one batch size, reused by every batch of that size
+class BatchBuffers:
+    As: list[np.array]
+    Y: np.array
+    deltas: list[np.array]
+    scratch: list[np.array]
+
+    def __init__(self, sizes, batch, dtype):
+        self.As = [np.empty((n, batch), dtype=dtype) for n in sizes]
+        self.Y = np.empty((sizes[-1], batch), dtype=dtype)
+        self.deltas = [np.empty((n, batch), dtype=dtype) for n in sizes[1:]]
+        self.scratch = [np.empty((n, batch), dtype=dtype) for n in sizes[1:]]
+
+
+class NeuralNetwork:
+    learn_rate: float
+    correct_in_epoch: int
+    epochs_done: int
+    dtype: np.dtype
+
+    # With preallocate the buffers of the current batch sizes and the weight gradients are reused
+    preallocate: bool
+    buffers: dict[int, BatchBuffers]
+    dWs: list[np.array]
+    dBs: list[np.array]
+
+    # Input / Output
+    X: np.array
+    Y: np.array
+
+    # Layer functions
+    fs: list[Callable[[np.array], np.array]]
+
+    # Weights
+    Ws: list[np.array]
+
+    # Biases
+    Bs: list[np.array]
+
+    # layers
+    As: list[np.array]
+
+    # Activations write into out when it is given, otherwise into a new array
+    def sigmoid(self, X, out=None):
+        out = np.negative(X, out=out)
+        np.exp(out, out=out)
+        out += 1
+        return np.reciprocal(out, out=out)
+
+    def deriv_sigmoid(self, X, out=None):
+        out = np.subtract(1, X, out=out)
+        out *= X
+        return out
+
+    def softmax(self, X, out=None):
+        exp = np.exp(X, out=out)
+        # columns are samples, each one is normalized on its own
+        return np.divide(exp, np.sum(exp, axis=0, keepdims=True), out=out)
+
+    def __init__(
+            self,
+            reshape_input=True,
+            learn_rate=0.01,
+            neuron_layers=np.array([784, 10, 10]),
+            dtype=np.float32,
+            preallocate=True,
+    ):
+        self.learn_rate = learn_rate
+        self.reshape_input = reshape_input
+        self.correct_in_epoch = 0
+        self.epochs_done = 0
+        self.dtype = np.dtype(dtype)
+        self.preallocate = preallocate
+        self.buffers = {}
+        self.dWs = []
+        self.dBs = []
+        self.Ws = []
+        self.Bs = []
+
+        for i, n in enumerate(neuron_layers[:-1]):
+            next_n = neuron_layers[i + 1]
+            W = np.random.uniform(-0.5, 0.5, (next_n, n)).astype(self.dtype)
+            B = np.random.uniform(-0.5, 0.5, (next_n, 1)).astype(self.dtype)
+            self.Ws.append(W)
+            self.Bs.append(B)
+
+        fs = [self.sigmoid] * (len(self.Ws) - 1)
+        fs.append(self.softmax)
+        self.fs = fs
+
+    def error(self, Y):
+        Ao = self.get_output()
+        return np.sum(((Ao - Y) ** 2)) / len(Ao)
+
+    def set_io(self, X, Y):
+        if self.reshape_input:
+            self.X = X.reshape(-1, 1)
+            self.Y = Y.reshape(-1, 1)
+        else:
+            self.X = X
+            self.Y = Y
+
+    # Batch of samples as rows is turned into (features x batch) matrices
+    def set_io_batch(self, Xs, Ys):
+        self.X = Xs.T
+        self.Y = Ys.T
+
+    def is_correct(self):
+        self.correct_in_epoch += int(np.sum(np.argmax(self.Y, axis=0) == np.argmax(self.get_output(), axis=0)))
+
+    # At most the full and the tail batch sizes are kept
+    def get_buffers(self, batch):
+        if batch not in self.buffers:
+            if len(self.buffers) >= 2:
+                self.buffers.clear()
+            self.buffers[batch] = BatchBuffers(self.layer_sizes(), batch, self.dtype)
+        if not self.dWs:
+            self.dWs = [np.empty(W.shape, dtype=self.dtype) for W in self.Ws]
+            self.dBs = [np.empty(B.shape, dtype=self.dtype) for B in self.Bs]
+        return self.buffers[batch]
+
+    def forward_propagation(self):
+        if self.preallocate:
+            return self.forward_propagation_inplace()
+
+        self.As = [self.X]
+        for i, (W, B, f) in enumerate(zip(self.Ws, self.Bs, self.fs)):
+            A = f(B + np.dot(W, self.As[i]).reshape(W.shape[0], -1))
+            self.As.append(A)
+
+    def forward_propagation_inplace(self):
+        X = self.X.reshape(self.X.shape[0], -1)
+        buffers = self.get_buffers(X.shape[1])
+        np.copyto(buffers.As[0], X, casting="unsafe")
+        np.copyto(buffers.Y, self.Y.reshape(buffers.Y.shape), casting="unsafe")
+        self.Y = buffers.Y
+        self.As = buffers.As
+
+        for i, (W, B, f) in enumerate(zip(self.Ws, self.Bs, self.fs)):
+            A = np.dot(W, self.As[i], out=self.As[i + 1])
+            A += B
+            f(A, out=A)
+
+    def backward_propagation(self):
+        if self.preallocate:
+            return self.backward_propagation_inplace()
+
+        # averages over the batch as well, as Y.size is outputs * batch size
+        m = self.Y.size
+        prev_delta = None
+        last_index = len(self.Ws) - 1
+
+        for i in range(last_index, -1, -1):
+            if i == last_index:
+                delta = self.As[i + 1] - self.Y
+            else:
+                delta = np.dot(self.Ws[i + 1].T, prev_delta) * self.deriv_sigmoid(self.As[i + 1])
+
+            self.Ws[i] += 1 / m * np.dot(delta, self.As[i].T) * -self.learn_rate
+            self.Bs[i] += 1 / m * np.sum(delta, axis=1, keepdims=True) * -self.learn_rate
+
+            prev_delta = delta
+
+    # backward_propagation writing deltas and gradients into the buffers and updating the weights in place
+    def backward_propagation_inplace(self):
+        m = self.Y.size
+        buffers = self.get_buffers(self.Y.shape[1])
+        prev_delta = None
+        last_index = len(self.Ws) - 1
+
+        for i in range(last_index, -1, -1):
+            delta = buffers.deltas[i]
+            if i == last_index:
+                np.subtract(self.As[i + 1], self.Y, out=delta)
+            else:
+                np.dot(self.Ws[i + 1].T, prev_delta, out=delta)
+                delta *= self.deriv_sigmoid(self.As[i + 1], out=buffers.scratch[i])
+
+            dW = np.dot(delta, self.As[i].T, out=self.dWs[i])
+            dW *= 1 / m
+            dW *= -self.learn_rate
+            self.Ws[i] += dW
+
+            dB = np.sum(delta, axis=1, keepdims=True, out=self.dBs[i])
+            dB *= 1 / m
+            dB *= -self.learn_rate
+            self.Bs[i] += dB
+
+            prev_delta = delta
+
+    # Same gradients as backward_propagation, computed from the current weights without applying them
+    def gradients(self):
+        m = self.Y.size
+        dWs = [None] * len(self.Ws)
+        dBs = [None] * len(self.Bs)
+        delta = None
+        last_index = len(self.Ws) - 1
+
+        for i in range(last_index, -1, -1):
+            if i == last_index:
+                delta = self.As[i + 1] - self.Y
+            else:
+                delta = np.dot(self.Ws[i + 1].T, delta) * self.deriv_sigmoid(self.As[i + 1])
+
+            dWs[i] = 1 / m * np.dot(delta, self.As[i].T)
+            dBs[i] = 1 / m * np.sum(delta, axis=1, keepdims=True)
+        return dWs, dBs
+
+    def train_iteration(self, X, Y):
+        self.set_io(X, Y)
+        self.forward_propagation()
+        self.backward_propagation()
+        self.is_correct()
+
+    def train_batch(self, Xs, Ys):
+        self.set_io_batch(Xs, Ys)
+        self.forward_propagation()
+        self.backward_propagation()
+        self.is_correct()
+
+    # Arrays are cut into batch_size batches, a loader (Ys=None) yields its own (X, Y) batches
+    @staticmethod
+    def batches(Xs, Ys, batch_size):
+        if Ys is None:
+            yield from Xs
+            return
+        for start in range(0, len(Xs), batch_size):
+            yield Xs[start:start + batch_size], Ys[start:start + batch_size]
+
+    # With a checkpoint file the weights are saved every checkpoint_every epochs,
+    # and an existing checkpoint is loaded first so an interrupted run continues where it stopped
+    def train(self, Xs, Ys=None, epoch=5, batch_size=1, checkpoint=None, checkpoint_every=1):
+        # a resumed run only does the epochs its checkpoint is missing out of epoch, otherwise epoch more are run
+        last = self.epochs_done + epoch
+        if checkpoint and os.path.exists(checkpoint):
+            # read into memory: training rewrites every weight and save() replaces the checkpoint file
+            self.load_weights(checkpoint, mmap=False)
+            print(f"Resume from {checkpoint} after {self.epochs_done} epochs")
+            last = epoch
+
+        print("Start training")
+        for i in range(self.epochs_done, last):
+            print(f"Epoch {i + 1}")
+
+            samples = 0
+            for X, Y in self.batches(Xs, Ys, batch_size):
+                self.train_batch(X, Y)
+                samples += len(X)
+
+            print(f"Correct {self.correct_in_epoch} from {samples}")
+            print(f"Accuracy {self.correct_in_epoch / samples}\n")
+            self.correct_in_epoch = 0
+            self.epochs_done = i + 1
+
+            if checkpoint and (self.epochs_done % checkpoint_every == 0 or self.epochs_done == last):
+                self.save(checkpoint)
+
+    def layer_sizes(self):
+        return [self.Ws[0].shape[1]] + [W.shape[0] for W in self.Ws]
+
+    def save(self, path):
+        sizes = self.layer_sizes()
+        header = np.array([MODEL_VERSION, len(sizes), self.epochs_done, *sizes], dtype=np.uint32)
+        # written under a temporary name first so an interrupted save never breaks the previous file
+        with open(f"{path}.tmp", "wb") as file:
+            file.write(MODEL_MAGIC)
+            file.write(header.tobytes())
+            for W, B in zip(self.Ws, self.Bs):
+                file.write(np.ascontiguousarray(W, dtype=np.float32).tobytes())
+                file.write(np.ascontiguousarray(B, dtype=np.float32).tobytes())
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def read_header(path):
+        with open(path, "rb") as file:
+            if file.read(len(MODEL_MAGIC)) != MODEL_MAGIC:
+                raise ValueError(f"{path} is not a model file")
+            version, count, epochs_done = np.fromfile(file, dtype=np.uint32, count=3)
+            if version != MODEL_VERSION:
+                raise ValueError(f"{path} has unsupported model version {version}")
+            sizes = np.fromfile(file, dtype=np.uint32, count=count).tolist()
+            return sizes, int(epochs_done), file.tell()
+
+    # With mmap the weights are mapped copy-on-write: nothing is read until used and the file is never modified
+    def load_weights(self, path, mmap=True):
+        sizes, epochs_done, offset = self.read_header(path)
+        if sizes != self.layer_sizes():
+            raise ValueError(f"{path} has layers {sizes}, the model has {self.layer_sizes()}")
+
+        if mmap:
+            data = np.memmap(path, dtype=np.float32, mode="c", offset=offset)
+        else:
+            data = np.fromfile(path, dtype=np.float32, offset=offset)
+        if data.dtype != self.dtype:
+            data = data.astype(self.dtype)
+
+        self.Ws, self.Bs = split_params(data, sizes)
+        self.epochs_done = epochs_done
+
+    @classmethod
+    def load(cls, path, mmap=True, **kwargs):
+        sizes, *_ = cls.read_header(path)
+        model = cls(neuron_layers=sizes, **kwargs)
+        model.load_weights(path, mmap)
+        return model
+
+    def get_output(self):
+        return self.As[-1]
+
+    # Stateless inference for (N x features) samples, returns (N x outputs) probabilities
+    def predict_batch(self, Xs, chunk_size=1024):
+        outputs = []
+        for start in range(0, len(Xs), chunk_size):
+            A = np.asarray(Xs[start:start + chunk_size].T, dtype=self.dtype)
+            for W, B, f in zip(self.Ws, self.Bs, self.fs):
+                A = f(B + np.dot(W, A))
+            outputs.append(A.T)
+        if not outputs:
+            return np.empty((0, self.Ws[-1].shape[0]), dtype=self.dtype)
+        return np.concatenate(outputs)
+
+    # Accuracy and (label x prediction) confusion matrix over the whole set, given as arrays or as a loader
+    def evaluate(self, Xs, Ys=None, chunk_size=1024):
+        classes = self.Ws[-1].shape[0]
+        confusion = np.zeros(classes * classes, dtype=np.int64)
+        for X, Y in self.batches(Xs, Ys, chunk_size):
+            predictions = self.predict_batch(X, chunk_size).argmax(axis=1)
+            labels = Y.argmax(axis=1) if Y.ndim == 2 else np.int64(Y)
+            confusion += np.bincount(labels * classes + predictions, minlength=classes * classes)
+        confusion = confusion.reshape(classes, classes)
+        # an empty set has no correct prediction
+        return np.trace(confusion) / max(confusion.sum(), 1), confusion
+
+    def predict(self, X, Y, argmax=False):
+        self.set_io(X, Y)
+        self.forward_propagation()
+        # the output buffer is reused by the next forward pass
+        output = self.get_output().copy()
+        if argmax:
+            output = output.argmax()
+            Y = Y.argmax()
+        return output, Y
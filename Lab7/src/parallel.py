@@ -0,0 +1,169 @@
+import argparse
+import multiprocessing as mp
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from network import NeuralNetwork, params_count, split_params
+
+# gradients: every step the workers' gradients are averaged into the shared weights
+# average: workers train their own copy and the copies are averaged every sync_every steps
+MODES = ("gradients", "average")
+
+
+def shared_array(shm, shape, dtype):
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def copy_params(target_Ws, target_Bs, Ws, Bs):
+    for target, source in zip(target_Ws + target_Bs, Ws + Bs):
+        np.copyto(target, source)
+
+
+def train_worker(rank, workers, names, sizes, dtype, Xs, Ys, epoch, batch_size, learn_rate, mode, sync_every,
+                 barrier, correct):
+    # a failing worker breaks the barrier, so the others raise instead of waiting for it forever
+    try:
+        # one BLAS thread per worker, the processes themselves use the cores
+        with threadpool_limits(1):
+            params_shm, slots_shm = SharedMemory(name=names[0]), SharedMemory(name=names[1])
+            count = params_count(sizes)
+            params = shared_array(params_shm, (count,), dtype)
+            slots = shared_array(slots_shm, (workers, count), dtype)
+            shared_Ws, shared_Bs = split_params(params, sizes)
+            slot_Ws, slot_Bs = split_params(slots[rank], sizes)
+            # every worker reduces an equal part of the buffer
+            part = slice(rank * count // workers, (rank + 1) * count // workers)
+
+            model = NeuralNetwork(neuron_layers=sizes, learn_rate=learn_rate, dtype=dtype)
+            if mode == "gradients":
+                model.Ws, model.Bs = shared_Ws, shared_Bs
+            else:
+                model.Ws = [W.copy() for W in shared_Ws]
+                model.Bs = [B.copy() for B in shared_Bs]
+
+            steps = len(Xs) // batch_size
+            for i in range(epoch):
+                for step in range(steps):
+                    batch = slice(step * batch_size, (step + 1) * batch_size)
+                    model.set_io_batch(Xs[batch], Ys[batch])
+                    model.forward_propagation()
+                    model.is_correct()
+
+                    if mode == "gradients":
+                        copy_params(slot_Ws, slot_Bs, *model.gradients())
+                        barrier.wait()
+                        params[part] -= learn_rate * slots[:, part].mean(axis=0)
+                        barrier.wait()
+                    else:
+                        model.backward_propagation()
+                        if (step + 1) % sync_every == 0 or step == steps - 1:
+                            copy_params(slot_Ws, slot_Bs, model.Ws, model.Bs)
+                            barrier.wait()
+                            params[part] = slots[:, part].mean(axis=0)
+                            barrier.wait()
+                            copy_params(model.Ws, model.Bs, shared_Ws, shared_Bs)
+
+                correct[rank] = model.correct_in_epoch
+                model.correct_in_epoch = 0
+                barrier.wait()
+                if rank == 0:
+                    total = steps * batch_size * workers
+                    print(f"Epoch {i + 1}")
+                    print(f"Correct {sum(correct)} from {total}")
+                    print(f"Accuracy {sum(correct) / total}\n")
+                barrier.wait()
+
+            del params, slots, shared_Ws, shared_Bs, slot_Ws, slot_Bs, model
+            params_shm.close()
+            slots_shm.close()
+    except BaseException:
+        barrier.abort()
+        raise
+
+
+# Data-parallel training: the set is split into one shard per worker process,
+# the weights live in shared memory and are written back into the model at the end
+def train_parallel(model, Xs, Ys, epoch=5, batch_size=32, workers=4, mode="gradients", sync_every=10):
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {MODES}")
+
+    sizes = model.layer_sizes()
+    dtype = model.dtype
+    count = params_count(sizes)
+    params_shm = SharedMemory(create=True, size=count * dtype.itemsize)
+    slots_shm = SharedMemory(create=True, size=workers * count * dtype.itemsize)
+    try:
+        params = shared_array(params_shm, (count,), dtype)
+        copy_params(*split_params(params, sizes), model.Ws, model.Bs)
+
+        barrier = mp.Barrier(workers)
+        correct = mp.Array("q", workers, lock=False)
+        shard = len(Xs) // workers
+        processes = [
+            mp.Process(target=train_worker, args=(
+                rank, workers, (params_shm.name, slots_shm.name), sizes, dtype,
+                Xs[rank * shard:(rank + 1) * shard], Ys[rank * shard:(rank + 1) * shard],
+                epoch, batch_size, model.learn_rate, mode, sync_every, barrier, correct,
+            ))
+            for rank in range(workers)
+        ]
+        print(f"Start training on {workers} workers ({mode})")
+        for process in processes:
+            process.start()
+        # a worker killed without a Python exception (out of memory) cannot break the barrier itself
+        while any(process.is_alive() for process in processes):
+            for process in processes:
+                process.join(timeout=0.1)
+                if process.exitcode not in (None, 0):
+                    barrier.abort()
+        failed = [rank for rank, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Training workers {failed} failed")
+
+        Ws, Bs = split_params(params, sizes)
+        model.Ws = [W.copy() for W in Ws]
+        model.Bs = [B.copy() for B in Bs]
+        model.epochs_done += epoch
+        del params, Ws, Bs
+    finally:
+        params_shm.close()
+        params_shm.unlink()
+        slots_shm.close()
+        slots_shm.unlink()
+    return model
+
+
+def benchmark(Xs, Ys, sizes, worker_counts, batch_size=32, mode="gradients", sync_every=10):
+    results = []
+    for workers in worker_counts:
+        np.random.seed(0)
+        model = NeuralNetwork(neuron_layers=sizes)
+        start = time.perf_counter()
+        train_parallel(model, Xs, Ys, epoch=1, batch_size=batch_size, workers=workers, mode=mode,
+                       sync_every=sync_every)
+        elapsed = time.perf_counter() - start
+        samples = len(Xs) // workers // batch_size * batch_size * workers
+        results.append((workers, samples / elapsed))
+
+    print(f"Workers | samples/sec | speedup ({mode}, batch {batch_size})")
+    for workers, rate in results:
+        print(f"{workers:7} | {rate:11.0f} | x{rate / results[0][1]:.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    import utils
+
+    parser = argparse.ArgumentParser(description="Samples per second of data-parallel training by worker count")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("-b", "--batch-size", type=int, default=32)
+    parser.add_argument("-m", "--mode", choices=MODES, default="gradients")
+    parser.add_argument("-s", "--sync-every", type=int, default=10)
+    args = parser.parse_args()
+
+    train_data, train_labels = utils.read_train_data()
+    benchmark(train_data, train_labels, [784, 300, 100, 50, 20, 10], args.workers, args.batch_size, args.mode,
+              args.sync_every)
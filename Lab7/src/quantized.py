@@ -0,0 +1,133 @@
+import argparse
+import time
+
+import numpy as np
+
+import utils
+from network import NeuralNetwork
+
+QMAX = 127
+# Every integer below this is exact in float32
+FLOAT32_EXACT = 2 ** 24
+
+
+# Symmetric scale that maps [-max|values|, max|values|] onto [-127, 127]
+def symmetric_scale(values):
+    peak = float(np.max(np.abs(values)))
+    return peak / QMAX if peak > 0 else 1.0
+
+
+def quantize(values, scale, dtype=np.int8):
+    values = np.rint(np.multiply(values, 1 / scale, dtype=np.result_type(np.float32, dtype)))
+    return np.clip(values, -QMAX, QMAX, out=values).astype(dtype, copy=False)
+
+
+# Sums of n int8 * int8 products stay exact in float32 while n * 127 * 127 < 2 ** 24,
+# numpy only has a BLAS matmul for floats, its int32 matmul is two orders of magnitude slower
+def accumulator_dtype(n):
+    return np.float32 if n * QMAX * QMAX < FLOAT32_EXACT else np.float64
+
+
+# Post-training quantized copy of a NeuralNetwork for inference: int8 weights with one scale per layer,
+# layer inputs quantized to int8 with scales calibrated on sample data. The int8 values are multiplied
+# and summed in a float type, exactly, as numpy has no fast integer matmul
+class QuantizedNetwork:
+    # Weights
+    Ws: list[np.array]
+    w_scales: list[float]
+
+    # Biases, added in float after the accumulation is rescaled
+    Bs: list[np.array]
+
+    # Scale of the input of every layer
+    a_scales: list[float]
+
+    # Layer functions
+    fs: list
+
+    def __init__(self, model, calibration):
+        self.Ws = []
+        self.w_scales = []
+        self.Bs = [np.asarray(B, dtype=np.float32) for B in model.Bs]
+        self.fs = [self.sigmoid] * (len(model.Ws) - 1) + [self.softmax]
+        for W in model.Ws:
+            scale = symmetric_scale(W)
+            self.Ws.append(quantize(W, scale))
+            self.w_scales.append(scale)
+
+        # the float model runs once on the sample, each layer input range gives its scale
+        self.a_scales = []
+        A = np.asarray(calibration.T, dtype=np.float32)
+        for W, B, f in zip(model.Ws, self.Bs, self.fs):
+            self.a_scales.append(symmetric_scale(A))
+            A = f(B + np.dot(np.asarray(W, dtype=np.float32), A))
+
+    @classmethod
+    def from_file(cls, path, calibration):
+        return cls(NeuralNetwork.load(path), calibration)
+
+    sigmoid = NeuralNetwork.sigmoid
+    softmax = NeuralNetwork.softmax
+    batches = staticmethod(NeuralNetwork.batches)
+    evaluate = NeuralNetwork.evaluate
+
+    def nbytes(self):
+        return sum(W.nbytes + B.nbytes for W, B in zip(self.Ws, self.Bs))
+
+    def predict_batch(self, Xs, chunk_size=1024):
+        outputs = []
+        for start in range(0, len(Xs), chunk_size):
+            A = np.asarray(Xs[start:start + chunk_size].T, dtype=np.float32)
+            for W, B, f, w_scale, a_scale in zip(self.Ws, self.Bs, self.fs, self.w_scales, self.a_scales):
+                acc_dtype = accumulator_dtype(W.shape[1])
+                # the products are summed as whole numbers in the float accumulator type, see accumulator_dtype,
+                # only the weights of the current layer are widened, the model itself stays int8
+                acc = np.dot(W.astype(acc_dtype), quantize(A, a_scale, acc_dtype))
+                acc *= w_scale * a_scale
+                acc += B
+                acc = acc.astype(np.float32, copy=False)
+                A = f(acc, out=acc)
+            outputs.append(A.T)
+        if not outputs:
+            return np.empty((0, self.Ws[-1].shape[0]), dtype=np.float32)
+        return np.concatenate(outputs)
+
+
+def timed_evaluate(model, Xs, Ys, chunk_size, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        accuracy, _ = model.evaluate(Xs, Ys, chunk_size)
+        best = min(best, time.perf_counter() - start)
+    return accuracy, best
+
+
+def report(model, quantized, Xs, Ys, chunk_size=1024, repeat=3):
+    float_bytes = sum(W.nbytes + B.nbytes for W, B in zip(model.Ws, model.Bs))
+    float_accuracy, float_time = timed_evaluate(model, Xs, Ys, chunk_size, repeat)
+    int8_accuracy, int8_time = timed_evaluate(quantized, Xs, Ys, chunk_size, repeat)
+    agreement = np.mean(model.predict_batch(Xs, chunk_size).argmax(axis=1)
+                        == quantized.predict_batch(Xs, chunk_size).argmax(axis=1))
+
+    print(f"Layers {model.layer_sizes()}, {len(Xs)} test samples, chunk {chunk_size}")
+    print(f"{'model':8}| accuracy | samples/sec | weight bytes")
+    for name, accuracy, elapsed, nbytes in [
+        (str(model.dtype), float_accuracy, float_time, float_bytes),
+        ("int8", int8_accuracy, int8_time, quantized.nbytes()),
+    ]:
+        print(f"{name:8}| {accuracy:8.4f} | {len(Xs) / elapsed:11.0f} | {nbytes:>12}")
+    print(f"Same prediction on {agreement:.2%} of the samples")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy and speed of the int8 model against the float model")
+    parser.add_argument("model", nargs="?", default="model.bin")
+    parser.add_argument("-c", "--calibration", type=int, default=1000, help="training samples used for scales")
+    parser.add_argument("-b", "--chunk-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    model = NeuralNetwork.load(args.model)
+    train_data, _ = utils.read_train_data()
+    quantized = QuantizedNetwork(model, train_data[:args.calibration])
+    test_data, test_labels = utils.read_test_data()
+    report(model, quantized, test_data, test_labels, args.chunk_size)
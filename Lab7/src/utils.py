@@ -1,7 +1,14 @@
+import json
+import os
+import threading
+from queue import Queue, Full
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+CACHE_DIR = "dataset/cache"
+
 
 def draw_image(img, title):
     plt.imshow(img.reshape(28, 28), cmap="Greys")
@@ -10,20 +17,166 @@ def draw_image(img, title):
 
 
 def prepare_label(ys):
-    ys = np.int64(ys)
+    ys = np.int64(ys).ravel()
     blank = np.zeros((len(ys), ys.max() + 1))
-    for i, y in enumerate(ys):
-        blank[i, y] = 1
+    blank[np.arange(len(ys)), ys] = 1
     return blank
 
 
+def source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+# Parses the csv once into a .npy file next to a stamp of the source, later calls memory-map it
+def read_cached(csv_path, dtype):
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    cache_path = os.path.join(CACHE_DIR, f"{name}.npy")
+    stamp_path = os.path.join(CACHE_DIR, f"{name}.json")
+
+    if not os.path.exists(csv_path) and os.path.exists(cache_path):
+        return np.load(cache_path, mmap_mode="r")
+
+    stamp = source_stamp(csv_path)
+    if os.path.exists(cache_path) and os.path.exists(stamp_path):
+        with open(stamp_path) as file:
+            if json.load(file) == stamp:
+                return np.load(cache_path, mmap_mode="r")
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    data = np.array(pd.read_csv(csv_path), dtype=dtype)
+    # written under a temporary name first so an interrupted run never leaves a broken cache
+    np.save(f"{cache_path}.tmp.npy", data)
+    os.replace(f"{cache_path}.tmp.npy", cache_path)
+    with open(stamp_path, "w") as file:
+        json.dump(stamp, file)
+    del data
+    return np.load(cache_path, mmap_mode="r")
+
+
 def read_train_data():
-    data = np.array(pd.read_csv("dataset/data_train.csv"))
-    labels = np.array(pd.read_csv("dataset/target_train.csv"))
+    data = read_cached("dataset/data_train.csv", np.uint8)
+    labels = read_cached("dataset/target_train.csv", np.int64)
     return data, prepare_label(labels)
 
 
 def read_test_data():
-    data = np.array(pd.read_csv("dataset/data_test.csv"))
-    labels = np.array(pd.read_csv("dataset/target_test.csv"))
+    data = read_cached("dataset/data_test.csv", np.uint8)
+    labels = read_cached("dataset/target_test.csv", np.int64)
     return data, prepare_label(labels)
+
+
+# Runs an iterator on a background thread, keeping up to depth items ready ahead of the consumer
+def prefetch(iterator, depth=2):
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def produce():
+        try:
+            for item in iterator:
+                put(item)
+                if stop.is_set():
+                    return
+        except Exception as error:
+            put(error)
+        finally:
+            put(end)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = queue.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def read_chunks(path, chunk_size):
+    if path.endswith(".npy"):
+        data = np.load(path, mmap_mode="r")
+        for start in range(0, len(data), chunk_size):
+            yield np.asarray(data[start:start + chunk_size])
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            yield chunk.to_numpy()
+
+
+# Out-of-core loader: reads data and labels (.csv or .npy) in chunks on a background thread,
+# shuffles inside a window of buffer_chunks chunks and yields float32 (X, one-hot Y) batches.
+# Every iteration is a new pass over the files, so it can be used for any number of epochs.
+class StreamLoader:
+    data_path: str
+    labels_path: str
+    batch_size: int
+    chunk_size: int
+    buffer_chunks: int
+    shuffle: bool
+    classes: int
+    dtype: np.dtype
+    rng: np.random.Generator
+
+    def __init__(self, data_path, labels_path, batch_size=32, chunk_size=4096, buffer_chunks=4, shuffle=True,
+                 classes=10, dtype=np.float32, seed=0):
+        self.data_path = data_path
+        self.labels_path = labels_path
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.buffer_chunks = buffer_chunks
+        self.shuffle = shuffle
+        self.classes = classes
+        self.dtype = dtype
+        self.rng = np.random.default_rng(seed)
+
+    def windows(self):
+        window = []
+        chunks = zip(read_chunks(self.data_path, self.chunk_size), read_chunks(self.labels_path, self.chunk_size))
+        for data, labels in prefetch(chunks):
+            window.append((data, np.int64(labels).ravel()))
+            if len(window) == self.buffer_chunks:
+                yield window
+                window = []
+        if window:
+            yield window
+
+    def __iter__(self):
+        rest = None
+        for window in self.windows():
+            if rest is not None:
+                window.insert(0, rest)
+            data = np.concatenate([data for data, _ in window])
+            labels = np.concatenate([labels for _, labels in window])
+            order = self.rng.permutation(len(data)) if self.shuffle else np.arange(len(data))
+
+            # the incomplete tail batch waits for the next window
+            full = len(order) - len(order) % self.batch_size
+            for start in range(0, full, self.batch_size):
+                batch = order[start:start + self.batch_size]
+                yield self.prepare(data[batch], labels[batch])
+            rest = (data[order[full:]], labels[order[full:]])
+
+        if rest is not None and len(rest[0]):
+            yield self.prepare(*rest)
+
+    def prepare(self, data, labels):
+        return data.astype(self.dtype), np.eye(self.classes, dtype=self.dtype)[labels]
+
+
+def stream_train_data(**kwargs):
+    return StreamLoader("dataset/data_train.csv", "dataset/target_train.csv", **kwargs)
+
+
+def stream_test_data(**kwargs):
+    return StreamLoader("dataset/data_test.csv", "dataset/target_test.csv", shuffle=False, **kwargs)